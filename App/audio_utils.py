@@ -4,28 +4,42 @@
 #
 #   https://github.com/Captain-FLAM/KaraFan
 
-import librosa, numpy as np
+import functools, math, librosa, numpy as np
 
 from scipy import signal
-from scipy.signal import resample_poly
 
 MAX_SPEC = 'Max Spec'
 MIN_SPEC = 'Min Spec'
 AVERAGE  = 'Average'
 
-def Normalize(audio):
+# Spectrograms of the ensembles
+N_FFT = 4096
+HOP   = 1024
+
+# Length of the FIR filter of "Pass_filter()"
+PASS_FILTER_TAPS = 1001
+
+# Ensembles are made by blocks of STFT frames (~ 6 sec.) : memory stays low, whatever the song's length
+ENSEMBLE_BLOCK = 256
+
+# SRS is resampled by blocks of output frames (~ 8 MB of temporaries), at least 16 samples per frame
+RESAMPLE_BLOCK   = 16384
+RESAMPLE_OUTPUTS = 16
+
+def Normalize(audio, stats = None):
 	"""
 	Normalize audio to -1.0 dB peak amplitude
 	This is mandatory because every process is based on RMS dB levels.
 	(Volumes Compensations & audio Substractions)
+	"stats" : (mean, peak) of the WHOLE song, when "audio" is only a block of it (see "Normalize_Stats()")
 	"""
 	audio = audio.T
 	
 	# Suppress DC shift (center on 0.0 vertically)
-	audio -= np.mean(audio)
+	audio -= np.mean(audio) if stats is None else stats[0]
 
 	# Normalize audio peak amplitude to -1.0 dB
-	max_peak = np.max(np.abs(audio))
+	max_peak = np.max(np.abs(audio)) if stats is None else stats[1]
 	if max_peak > 0.0:
 		max_db = 10 ** (-1.0 / 20)  # Convert -1.0 dB to linear scale
 		audio /= max_peak
@@ -33,6 +47,23 @@ def Normalize(audio):
 
 	return audio.T
 
+def Normalize_Stats(blocks):
+	"""
+	Same (mean, peak) as "Normalize()" would find, but read block by block (for very long songs)
+	"""
+	total = 0.0;  count = 0;  low = np.inf;  high = -np.inf
+
+	for audio in blocks:
+		total += np.sum(audio, dtype=np.float64)
+		count += audio.size
+		low  = min(low,  np.min(audio))
+		high = max(high, np.max(audio))
+
+	if count == 0:  return 0.0, 0.0
+
+	mean = total / count
+	return mean, max(high - mean, mean - low)
+
 def Silent(audio_in, sample_rate, threshold_db = -50):
 	"""
 	Make silent the parts of audio where dynamic range (RMS) goes below threshold.
@@ -49,47 +80,70 @@ def Silent(audio_in, sample_rate, threshold_db = -50):
 	fade_out		= np.linspace(1.0, 0.0, fade_duration)
 	fade_in			= np.linspace(0.0, 1.0, fade_duration)
 
-	start = 0; end = 0; audio_length = audio_in.shape[1]
+	audio_length = audio_in.shape[1]
 	audio = audio_in.copy()
 
-	for i in range(0, audio_length, window_frame):
-		
-		# TODO : Maybe use S=audio (Spectrogram) instead of y=audio ??
-		RMS = np.max(librosa.amplitude_to_db(librosa.feature.rms(y=audio[:, i:(i + window_frame)], frame_length=window_frame, hop_length=window_frame)))
-		
-		if RMS < threshold_db:
-			end = i + window_frame
-			# Last part (in case of silence at the end)
-			if i == audio_length - window_frame:
-				if end - start > min_size:
-					# Fade out
-					if start > fade_duration:
-						audio[:, start:(start + fade_duration)] *= fade_out
-						start += fade_duration
-
-					# Clean in between
-					audio[:, start:end] = 0.0
-		else:
-			# Clean the "min_size" samples found
-			if end - start > min_size:
-
-				# Fade out
-				if start > fade_duration:
-					audio[:, start:(start + fade_duration)] *= fade_out
-					start += fade_duration
-
-				# Fade in
-				if end < audio_length - fade_duration:
-					audio[:, (end - fade_duration):end] *= fade_in
-					end -= fade_duration
-		
-				# Clean in between
-				audio[:, start:end] = 0.0
+	silent = Silent_Windows(audio, window_frame, threshold_db)
+
+	# Runs of silent windows : [first, after[
+	edges  = np.diff(np.concatenate(([0], silent.astype(np.int8), [0])))
+	firsts = np.flatnonzero(edges == 1)
+	afters = np.flatnonzero(edges == -1)
+
+	for first, after in zip(firsts, afters):
+
+		# From the start of the last window with sound (or the beginning)
+		start = (first - 1) * window_frame if first > 0 else 0
+		end   = after * window_frame
+
+		if end - start <= min_size:  continue
+
+		if after < len(silent):
+			# Fade out
+			if start > fade_duration:
+				audio[:, start:(start + fade_duration)] *= fade_out
+				start += fade_duration
 
-			start = i
+			# Fade in
+			if end < audio_length - fade_duration:
+				audio[:, (end - fade_duration):end] *= fade_in
+				end -= fade_duration
+	
+			# Clean in between
+			audio[:, start:end] = 0.0
+
+		# Last part (in case of silence at the end) : only if the last window is complete
+		elif audio_length % window_frame == 0:
+			# Fade out
+			if start > fade_duration:
+				audio[:, start:(start + fade_duration)] *= fade_out
+				start += fade_duration
+
+			# Clean in between
+			audio[:, start:end] = 0.0
 
 	return audio
 
+def Silent_Windows(audio, window_frame, threshold_db):
+	"""
+	For each window of "window_frame" samples : True if its RMS (dB) is below threshold.
+	Same values as calling "librosa.feature.rms()" on each window, but all in one go.
+	"""
+	audio_length = audio.shape[1]
+	full = audio_length // window_frame
+
+	# Shape : (channels, windows, samples) -> librosa pads & frames each window separately
+	windows = audio[:, :(full * window_frame)].reshape(audio.shape[0], full, window_frame)
+	RMS = librosa.feature.rms(y=windows, frame_length=window_frame, hop_length=window_frame)
+	RMS = np.max(librosa.amplitude_to_db(RMS, top_db=None), axis=(0, 2, 3))
+
+	# Last window (shorter)
+	if audio_length > full * window_frame:
+		last = np.max(librosa.amplitude_to_db(librosa.feature.rms(y=audio[:, (full * window_frame):], frame_length=window_frame, hop_length=window_frame)))
+		RMS = np.append(RMS, last)
+
+	return RMS < threshold_db
+
 
 # - For the code below :
 #
@@ -118,27 +172,175 @@ def Silent(audio_in, sample_rate, threshold_db = -50):
 # ordre = 16 => filtre target freq = 16400hz
 
 def Linkwitz_Riley_filter(audio, cutoff, filter_type, sample_rate, order=4):
+	sos = Linkwitz_Riley_SOS(cutoff, filter_type, sample_rate, order)
+	filtered_audio = signal.sosfiltfilt(sos, audio)
+	return filtered_audio.T
+
+@functools.lru_cache(maxsize = 32)
+def Linkwitz_Riley_SOS(cutoff, filter_type, sample_rate, order=4):
+	"""
+	Butterworth filter of "order / 2" (applied forward & backward = Linkwitz-Riley of "order"),
+	in second-order sections : stable even for high orders
+	"""
 	if cutoff  < 0:  cutoff = 0
 	if cutoff >= 22000:  cutoff = 22000 # Hz
 	nyquist = 0.5 * sample_rate
 	normal_cutoff = cutoff / nyquist
-	b, a = signal.butter(order // 2, normal_cutoff, btype=filter_type, analog=False) # , output='sos')
-	filtered_audio = signal.filtfilt(b, a, audio)
-	return filtered_audio.T
+	return signal.butter(order // 2, normal_cutoff, btype=filter_type, analog=False, output='sos')  # Shared by all calls : DON'T modify it !
+
+class Crossover:
+	"""
+	Linkwitz-Riley crossover at "cutoff" : joins the low band of a signal with the high band of another
+	"""
+	def __init__(self, cutoff, sample_rate, order=4):
+		self.lowpass  = Linkwitz_Riley_SOS(cutoff, 'lowpass',  sample_rate, order)
+		self.highpass = Linkwitz_Riley_SOS(cutoff, 'highpass', sample_rate, order)
+
+	def Merge(self, low_audio, high_audio, out = None):
+		"""
+		Returns : lowpass(low_audio) + highpass(high_audio) -> shape (channels, samples), in "out" if given
+		Filtered channel by channel, directly into the output : no full-size temporary arrays.
+		"""
+		# Same precision as the filters (float64), as "filtfilt()" gives
+		if out is None:
+			out = np.empty(low_audio.shape, dtype=np.result_type(low_audio, high_audio, self.lowpass))
+
+		for channel in range(low_audio.shape[0]):
+			out[channel]  = signal.sosfiltfilt(self.lowpass,  low_audio[channel])
+			out[channel] += signal.sosfiltfilt(self.highpass, high_audio[channel])
+
+		return out
 
 # SRS
-def Change_sample_rate(data, up, down):
-	data = data.T
-	# print(f"SRS input audio shape: {data.shape}")
-	new_data = resample_poly(data, up, down)
-	# print(f"SRS output audio shape: {new_data.shape}")
-	return new_data.T
+def Change_sample_rate(data, up, down, out = None):
+	"""
+	Same result as "resample_poly(data.T, up, down).T" (max. difference < 1e-7), in float32
+	"""
+	return Resampler(up, down).Resample(data, out)
+
+@functools.lru_cache(maxsize = 16)
+def Resampler_Bank(up, down):
+	"""
+	Polyphase filter bank of "resample_poly()" (same Kaiser window FIR), for "up" and "down" without common divisor.
+	Each row of the matrix gives 1 output sample from a frame of "window" input samples,
+	and the frames of "periods" output periods follow each other by "step" input samples.
+	Returns : (matrix (window, outputs), step, first input sample of frame 0, window)
+	"""
+	half_len = 10 * max(up, down)
+	h = signal.firwin(2 * half_len + 1, 1.0 / max(up, down), window=('kaiser', 5.0)) * up
+
+	taps = -(-len(h) // up)
+	h = np.pad(h, (0, taps * up - len(h)))
+
+	# Several periods at once : a wider matrix product is much faster
+	periods = -(-RESAMPLE_OUTPUTS // up)
+	outputs = periods * up
+
+	# Output "r" = sum of h[phase + k * up] * input[offset - k]
+	offsets = [(r * down + half_len) // up - (taps - 1) for r in range(outputs)]
+	first	= min(offsets)
+	window	= max(offsets) - first + taps
+
+	matrix = np.zeros((outputs, window), dtype=np.float32)
+	for r in range(outputs):
+		phase = (r * down + half_len) % up
+		matrix[r, (offsets[r] - first):(offsets[r] - first + taps)] = h[phase::up][::-1]
+
+	matrix = np.ascontiguousarray(matrix.T)
+	matrix.flags.writeable = False  # Shared by all calls
+	return matrix, periods * down, first, window
+
+class Resampler:
+	"""
+	Resample by "up / down" with a cached polyphase filter bank, in float32 on channel-major audio (channels, samples).
+	Processed by blocks of RESAMPLE_BLOCK frames : the input & output can be memory-mapped files.
+	"""
+	def __init__(self, up, down):
+		divisor = math.gcd(up, down)
+		self.up   = up // divisor
+		self.down = down // divisor
+
+		if self.up != self.down:
+			self.matrix, self.step, self.first, self.window = Resampler_Bank(self.up, self.down)
+
+	def Length(self, samples):
+		return -(-samples * self.up // self.down)
+
+	def Resample(self, audio, out = None):
+		"""
+		Returns : resampled audio in "out" if given, then cut or padded with zeros to its length
+		"""
+		channels, samples = audio.shape
+		if out is None:
+			out = np.empty((channels, self.Length(samples)), dtype=np.float32)
+		
+		length = min(self.Length(samples), out.shape[1])
+		out[:, length:] = 0.0
+
+		if self.up == self.down:
+			out[:, :length] = audio[:, :length]
+			return out
+
+		outputs = self.matrix.shape[1]
+		frames  = -(-length // outputs)
+
+		for frame in range(0, frames, RESAMPLE_BLOCK):
+			count = min(RESAMPLE_BLOCK, frames - frame)
+			start = frame * self.step + self.first
+			end   = start + (count - 1) * self.step + self.window
+
+			# Input of these frames, with zeros outside of the audio
+			block = np.zeros((channels, end - start), dtype=np.float32)
+			block[:, (max(start, 0) - start):(min(end, samples) - start)] = audio[:, max(start, 0):min(end, samples)]
+
+			result = np.lib.stride_tricks.sliding_window_view(block, self.window, axis=-1)[:, ::self.step] @ self.matrix
+
+			position = frame * outputs
+			size = min(count * outputs, length - position)
+			out[:, position:(position + size)] = result.reshape(channels, -1)[:, :size]
+
+		return out
 
 # Lowpass filter
 def Pass_filter(type, cutoff, data, sample_rate):
-	b = signal.firwin(1001, cutoff, pass_zero=type, fs=sample_rate)
-	filtered_data = signal.filtfilt(b, [1.0], data)
-	return filtered_data
+	"""
+	Zero-phase FIR filter : same result as "signal.filtfilt(b, [1.0], data)" (max. difference < 1e-14),
+	but with only 1 FFT convolution (overlap-add) by the filter convolved with itself.
+	The padding of "filtfilt()" (3 x 1001 samples) is longer than this kernel :
+	its initial conditions have NO effect on the samples kept.
+	"""
+	padlen = 3 * PASS_FILTER_TAPS
+
+	# Too short : same error as "filtfilt()"
+	if data.shape[-1] <= padlen:
+		b = signal.firwin(PASS_FILTER_TAPS, cutoff, pass_zero=type, fs=sample_rate)
+		return signal.filtfilt(b, [1.0], data)
+
+	kernel = Pass_filter_Kernel(type, cutoff, sample_rate)
+	kernel = kernel.reshape((1,) * (data.ndim - 1) + (-1,))
+
+	# Odd extension, as "filtfilt()"
+	extended = np.concatenate((
+		2 * data[..., :1]  - data[..., padlen:0:-1],
+		data,
+		2 * data[..., -1:] - data[..., -2:-(padlen + 2):-1]), axis=-1)
+
+	# In float64, as "filtfilt()" (else the error is ~ 1e-7)
+	filtered_data = signal.oaconvolve(extended.astype(np.float64, copy=False), kernel, mode='full', axes=-1)
+
+	start = padlen + PASS_FILTER_TAPS - 1
+	return np.ascontiguousarray(filtered_data[..., start:(start + data.shape[-1])])
+
+@functools.lru_cache(maxsize = 32)
+def Pass_filter_Kernel(type, cutoff, sample_rate):
+	"""
+	The FIR filter applied forward AND backward (see "Pass_filter()")
+	"""
+	b = signal.firwin(PASS_FILTER_TAPS, cutoff, pass_zero=type, fs=sample_rate)
+
+	kernel = np.convolve(b, b[::-1])
+	kernel.flags.writeable = False  # Shared by all calls
+	return kernel
 
 # Match 2 audio Shapes
 def match_array_shapes(array_1:np.ndarray, array_2:np.ndarray):
@@ -158,59 +360,107 @@ def match_array_shapes(array_1:np.ndarray, array_2:np.ndarray):
 #
 # - https://github.com/Anjok07/ultimatevocalremovergui
 
-def Make_Ensemble(algorithm, audio_input):
+def Make_Ensemble(algorithm, audio_input, specs = None):
 
 	if len(audio_input) == 1:
 		return audio_input[0]
 	
-	waves = []
-	
 	if algorithm == AVERAGE:
 		output = average_audio(audio_input)
 	else:
-		specs = []
-		
-		for i in range(len(audio_input)):  
-			waves.append(audio_input[i])
-			spec = wave_to_spectrogram_no_mp(audio_input[i])
-			specs.append(spec)
-		
-		waves_shapes = [w.shape[1] for w in waves]
-		target_shape = waves[waves_shapes.index(max(waves_shapes))]
-		
-		output = spectrogram_to_wave_no_mp(ensembling(algorithm, specs))
-		output = to_shape(output, target_shape.shape)
+		output = Ensemble_Blocks(algorithm, audio_input, specs = specs)
 
 	return output
 
-def ensembling(a, specs):   
-	for i in range(1, len(specs)):
-		if i == 1:
-			spec = specs[0]
+def Spectrogram(wave):
+	"""
+	Full spectrogram of "wave", with the geometry of the ensembles :
+	give it to "Make_Ensemble(specs = ...)" to reuse it in several ensembles (no STFT of this input again)
+	"""
+	if wave.ndim == 1:  wave = np.asfortranarray([wave, wave])
+
+	return librosa.stft(wave, n_fft=N_FFT, hop_length=HOP)
 
-		ln = min([spec.shape[2], specs[i].shape[2]])
-		spec = spec[:,:,:ln]
-		specs[i] = specs[i][:,:,:ln]
+def Ensemble_Blocks(algorithm, audio_input, block = ENSEMBLE_BLOCK, specs = None):
+	"""
+	Same result as the original "ensembling()" (see App/benchmark.py) on the full spectrograms, but made block by block :
+	for each block of "block" STFT frames (+ the frames overlapping its edges),
+	STFT of all inputs -> choice of the bin with the max (or min) magnitude in 1 pass -> iSTFT.
+	Only the samples covered by ALL their frames are kept : the junctions are exact.
+
+	specs : for each input, its spectrogram made by "Spectrogram()" or None (computed by blocks)
+	"""
+	waves = [np.asfortranarray([wave, wave]) if wave.ndim == 1 else wave for wave in audio_input]
+	specs = specs or [None] * len(waves)
+
+	margin  = N_FFT // 2
+	lengths = [wave.shape[1] for wave in waves]
+	frames  = 1 + min(lengths) // HOP  # Same as the original : truncated to the shortest input
+	overlap = int(np.ceil(N_FFT / HOP)) - 1  # Frames overlapping a sample, on each side
+
+	output = np.zeros((waves[0].shape[0], HOP * (frames - 1)), dtype=np.result_type(*waves))
+
+	for first in range(0, frames - 1, block):
+		last = min(first + block, frames - 1)  # Output samples : [first * HOP, last * HOP[
+
+		# All the frames covering these samples
+		frame_1 = max(0, first - overlap + 1)
+		frame_2 = min(frames, last + overlap)
+
+		blocks = []
+		for wave, length, spec in zip(waves, lengths, specs):
+			# Same frames as the block STFT below
+			if spec is not None:
+				blocks.append(spec[..., frame_1:frame_2])
+				continue
+
+			# Samples of these frames, with zeros outside of the wave (as "center = True")
+			start = frame_1 * HOP - margin
+			end   = (frame_2 - 1) * HOP - margin + N_FFT
+			
+			part = wave[:, max(0, start):min(length, end)]
+			part = np.pad(part, ((0, 0), (max(0, -start), max(0, end - length))))
+
+			blocks.append(librosa.stft(part, n_fft=N_FFT, hop_length=HOP, center=False))
 		
-		if MIN_SPEC == a:
-			spec = np.where(np.abs(specs[i]) <= np.abs(spec), specs[i], spec)
-		if MAX_SPEC == a:
-			spec = np.where(np.abs(specs[i]) >= np.abs(spec), specs[i], spec)  
-		if AVERAGE == a:
-			spec = np.where(np.abs(specs[i]) == np.abs(spec), specs[i], spec)  
+		spec = Choose_Bins(algorithm, blocks)
 
-	return spec
+		wave = librosa.istft(spec, n_fft=N_FFT, hop_length=HOP, center=False)
 
-def spectrogram_to_wave_no_mp(spec):
-	wave = librosa.istft(spec, n_fft=4096, hop_length=1024)
-	
-	if wave.ndim == 1:  wave = np.asfortranarray([wave, wave])
-	return wave
+		offset = margin - frame_1 * HOP
+		output[:, (first * HOP):(last * HOP)] = wave[:, (offset + first * HOP):(offset + last * HOP)]
+
+	# Output has the length of the longest input
+	return to_shape(output, (output.shape[0], max(lengths)))
+
+def Choose_Bins(algorithm, specs):
+	"""
+	Same choice as the original "ensembling()" in 1 pass over the inputs, with the running max (or min) magnitude :
+	the LAST input with the max (or min) magnitude wins a tie
+	"""
+	spec = specs[0].copy(order='K')  # Same memory layout as the others (faster)
+	best = np.abs(spec)
+
+	for other in specs[1:]:
+		magnitude = np.abs(other)
+		
+		if algorithm == MIN_SPEC:
+			mask = magnitude <= best
+		else:
+			mask = magnitude >= best
+
+		# Mixed precisions (complex64 & complex128) : promoted, as "np.where()" does
+		dtype = np.result_type(spec, other)
+		if dtype != spec.dtype:  spec = spec.astype(dtype, order='K')
+
+		np.copyto(spec, other, where=mask)
+
+		# Magnitudes are compared at the precision of the ensemble, as the original does
+		if other.dtype == spec.dtype and best.dtype == magnitude.dtype:
+			np.copyto(best, magnitude, where=mask)
+		else:
+			best = np.abs(spec)
 
-def wave_to_spectrogram_no_mp(wave):
-	spec = librosa.stft(wave, n_fft=4096, hop_length=1024)
-	
-	if spec.ndim == 1:  spec = np.asfortranarray([spec, spec])
 	return spec
 
 def to_shape(x, target_shape):
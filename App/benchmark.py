@@ -0,0 +1,355 @@
+#!python3.10
+
+#   MIT License - Copyright (c) 2023 Captain FLAM
+#
+#   https://github.com/Captain-FLAM/KaraFan
+
+# Speed & results of the optimized functions, compared with their original versions.
+#
+# Usage : python -m App.benchmark
+
+import tracemalloc, librosa, numpy as np
+
+from scipy import signal
+
+from time import perf_counter
+
+import App.audio_utils, App.cache, App.compare, App.inference
+
+def Silent_Loop(audio_in, sample_rate, threshold_db = -50):
+	"""
+	Original version of "App.audio_utils.Silent()" : 1 window of 10 ms at a time
+	"""
+	min_size		= int(1.000 * sample_rate)  # 1000 ms
+	window_frame	= int(0.010 * sample_rate)  #   10 ms
+	fade_duration	= int(0.250 * sample_rate)  #  250 ms
+	fade_out		= np.linspace(1.0, 0.0, fade_duration)
+	fade_in			= np.linspace(0.0, 1.0, fade_duration)
+
+	start = 0; end = 0; audio_length = audio_in.shape[1]
+	audio = audio_in.copy()
+
+	for i in range(0, audio_length, window_frame):
+
+		RMS = np.max(librosa.amplitude_to_db(librosa.feature.rms(y=audio[:, i:(i + window_frame)], frame_length=window_frame, hop_length=window_frame)))
+
+		if RMS < threshold_db:
+			end = i + window_frame
+			# Last part (in case of silence at the end)
+			if i == audio_length - window_frame:
+				if end - start > min_size:
+					# Fade out
+					if start > fade_duration:
+						audio[:, start:(start + fade_duration)] *= fade_out
+						start += fade_duration
+
+					# Clean in between
+					audio[:, start:end] = 0.0
+		else:
+			# Clean the "min_size" samples found
+			if end - start > min_size:
+
+				# Fade out
+				if start > fade_duration:
+					audio[:, start:(start + fade_duration)] *= fade_out
+					start += fade_duration
+
+				# Fade in
+				if end < audio_length - fade_duration:
+					audio[:, (end - fade_duration):end] *= fade_in
+					end -= fade_duration
+
+				# Clean in between
+				audio[:, start:end] = 0.0
+
+			start = i
+
+	return audio
+
+def Test_Audio(seconds, sample_rate = 44100, seed = 0):
+	"""
+	Stereo noise with silent parts of different lengths (and one at the end)
+	"""
+	random = np.random.default_rng(seed)
+	audio = (random.standard_normal((2, int(seconds * sample_rate))) * 0.1).astype(np.float32)
+
+	position = 0
+	while position < audio.shape[1]:
+		length = int(random.uniform(0.2, 4.0) * sample_rate)
+		audio[:, position:(position + length)] *= random.choice([0.0, 1e-4, 1.0])
+		position += length + int(random.uniform(0.5, 5.0) * sample_rate)
+
+	audio[:, -2 * sample_rate:] = 0.0
+	return audio
+
+def Timing(function, *args, repeat = 3):
+	"""
+	Returns : (best time in seconds, result)
+	"""
+	best = np.inf
+	for _ in range(repeat):
+		start = perf_counter()
+		result = function(*args)
+		best = min(best, perf_counter() - start)
+
+	return best, result
+
+def Compare(name, original, optimized, *args):
+
+	time_1, result_1 = Timing(original, *args)
+	time_2, result_2 = Timing(optimized, *args)
+
+	error = np.max(np.abs(result_1 - result_2))
+	print(f"{name:<40} : {time_1:8.3f} sec -> {time_2:8.3f} sec  (x {time_1 / time_2:6.1f})  -  max. difference : {error:.3g}")
+
+def Silent():
+
+	for seconds, sample_rate in [(60, 44100), (60.005, 44100), (60, 48000)]:
+		audio = Test_Audio(seconds, sample_rate)
+
+		for threshold in [-50, -61, -45]:
+			Compare(f"Silent ({seconds} sec, {sample_rate} Hz, {threshold} dB)",
+				Silent_Loop, App.audio_utils.Silent, audio, sample_rate, threshold)
+
+def Repair_Loop(instrum, extracts):
+	"""
+	Original "Repair Instrumental" of "SEPARATE()" : STFT & iSTFT again for each extract
+	"""
+	for audio in extracts:
+		instrum = App.audio_utils.Make_Ensemble('Max Spec', [instrum, audio])
+
+	return instrum
+
+def Repair_Ensemble(instrum, extracts):
+	"""
+	"Repair Instrumental" of "Separate_Audio()" : all extracts in 1 ensemble, made by blocks
+	"""
+	return App.audio_utils.Make_Ensemble('Max Spec', [instrum] + extracts)
+
+def ensembling(a, specs):   
+	"""
+	Original ensemble of "App.audio_utils" (UVR 5) : reference of "Ensemble_Blocks()"
+	"""
+	for i in range(1, len(specs)):
+		if i == 1:
+			spec = specs[0]
+
+		ln = min([spec.shape[2], specs[i].shape[2]])
+		spec = spec[:,:,:ln]
+		specs[i] = specs[i][:,:,:ln]
+		
+		if App.audio_utils.MIN_SPEC == a:
+			spec = np.where(np.abs(specs[i]) <= np.abs(spec), specs[i], spec)
+		if App.audio_utils.MAX_SPEC == a:
+			spec = np.where(np.abs(specs[i]) >= np.abs(spec), specs[i], spec)  
+		if App.audio_utils.AVERAGE == a:
+			spec = np.where(np.abs(specs[i]) == np.abs(spec), specs[i], spec)  
+
+	return spec
+
+def spectrogram_to_wave_no_mp(spec):
+	wave = librosa.istft(spec, n_fft=4096, hop_length=1024)
+	
+	if wave.ndim == 1:  wave = np.asfortranarray([wave, wave])
+	return wave
+
+def wave_to_spectrogram_no_mp(wave):
+	spec = librosa.stft(wave, n_fft=4096, hop_length=1024)
+	
+	if spec.ndim == 1:  spec = np.asfortranarray([spec, spec])
+	return spec
+
+def Ensemble_Full(algorithm, audio_input):
+	"""
+	Original "Make_Ensemble()" : full spectrograms of ALL inputs at once
+	"""
+	specs = [wave_to_spectrogram_no_mp(audio) for audio in audio_input]
+	
+	output = spectrogram_to_wave_no_mp(ensembling(algorithm, specs))
+	return App.audio_utils.to_shape(output, (output.shape[0], max(audio.shape[1] for audio in audio_input)))
+
+def Peak_Memory(function, *args):
+	"""
+	Returns : peak of memory allocated by "function" (in MB)
+	"""
+	tracemalloc.start()
+	function(*args)
+	_, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+
+	return peak / 1048576
+
+def Ensemble():
+
+	inputs = [Test_Audio(180, seed = i) for i in range(4)]
+
+	Compare("Max Spec (4 inputs, 3 min.)", Ensemble_Full, App.audio_utils.Make_Ensemble, 'Max Spec', inputs)
+	print(f"{'':<40}   Peak memory : {Peak_Memory(Ensemble_Full, 'Max Spec', inputs):8.0f} MB -> {Peak_Memory(App.audio_utils.Make_Ensemble, 'Max Spec', inputs):8.0f} MB")
+
+	# An input given by its spectrogram (computed once, reused by several ensembles) : same result
+	specs = [App.audio_utils.Spectrogram(inputs[0])] + [None] * (len(inputs) - 1)
+
+	Compare("Max Spec (1 spectrogram given)", App.audio_utils.Make_Ensemble, lambda *args: App.audio_utils.Make_Ensemble(*args, specs = specs), 'Max Spec', inputs)
+
+
+	# Results are NOT the same with more than 1 extract :
+	# the intermediate results don't round-trip through iSTFT & STFT
+	for count in [1, 2, 3]:
+		instrum  = Test_Audio(60, seed = 0)
+		extracts = [Test_Audio(60, seed = 1 + i) for i in range(count)]
+
+		Compare(f"Repair Instrumental ({count} extracts)", Repair_Loop, Repair_Ensemble, instrum, extracts)
+
+def Pass_filter_Direct(type, cutoff, data, sample_rate):
+	"""
+	Original "App.audio_utils.Pass_filter()" : direct-form filtering, forward & backward
+	"""
+	b = signal.firwin(1001, cutoff, pass_zero=type, fs=sample_rate)
+	return signal.filtfilt(b, [1.0], data)
+
+def Pass_filter():
+
+	audio = Test_Audio(180)
+
+	for type, cutoff in [('highpass', 85), ('highpass', 30)]:
+		Compare(f"Pass_filter ({type} {cutoff} Hz, 3 min.)", Pass_filter_Direct, App.audio_utils.Pass_filter, type, cutoff, audio, 44100)
+
+def SRS_Merge_Direct(low_audio, high_audio, cutoff, sample_rate):
+	"""
+	Original SRS merge of "Extract_with_Model()" : filters in (b, a) form, designed on each call
+	"""
+	def Filter(audio, filter_type):
+		b, a = signal.butter(2, cutoff / (0.5 * sample_rate), btype=filter_type)
+		return signal.filtfilt(b, a, audio).T
+
+	return (Filter(low_audio, 'lowpass') + Filter(high_audio, 'highpass')).T
+
+def SRS_Merge(low_audio, high_audio, cutoff, sample_rate):
+
+	return App.audio_utils.Crossover(cutoff, sample_rate).Merge(low_audio, high_audio)
+
+def Crossover():
+
+	low_audio  = Test_Audio(180, seed = 0)
+	high_audio = Test_Audio(180, seed = 1)
+
+	Compare("SRS Merge (14700 Hz, 3 min.)", SRS_Merge_Direct, SRS_Merge, low_audio, high_audio, 14700, 44100)
+	print(f"{'':<40}   Peak memory : {Peak_Memory(SRS_Merge_Direct, low_audio, high_audio, 14700, 44100):8.0f} MB -> {Peak_Memory(SRS_Merge, low_audio, high_audio, 14700, 44100):8.0f} MB")
+
+def Cache_Hits(cache, models, frames, frame_MB):
+	"""
+	Each model reads the spectrograms of all the frames of the song, in the same order as "demix_base()"
+	"""
+	spec = np.zeros(int(frame_MB * 1048576) // 4, dtype=np.float32)
+
+	for _ in range(models):
+		for frame in range(frames):
+			if cache.get(frame) is None:  cache.put(frame, spec)
+
+	return cache.hits
+
+def Spec_Cache():
+	"""
+	Hits of the spectrograms cache when the frames of a song don't fit in it :
+	3 models with the same FFT geometry, 64 frames of 1 MB
+	"""
+	for max_MB in [64, 56, 40, 8]:
+		hits_1 = Cache_Hits(App.cache.LRU_Cache(max_MB), 3, 64, 1)
+		hits_2 = Cache_Hits(App.cache.LRU_Cache(max_MB, keep_unused = True), 3, 64, 1)
+
+		print(f"{f'Spectrograms cache ({max_MB} MB / 64 MB)':<40} : {hits_1:4d} -> {hits_2:4d} hits  (max. {2 * min(max_MB, 64)})")
+
+		# The first frames stay until the next models use them
+		assert hits_2 == 2 * min(max_MB, 64)
+
+def Resample_Direct(audio, up, down):
+	"""
+	Original "App.audio_utils.Change_sample_rate()" : filter designed on each call, on the transposed audio
+	"""
+	return signal.resample_poly(audio.T, up, down).T
+
+def Resample():
+
+	audio = Test_Audio(180)
+
+	for up, down in [(5, 4), (6, 4), (4, 5), (4, 6)]:
+		Compare(f"SRS Resample ({up} / {down}, 3 min.)", Resample_Direct, App.audio_utils.Change_sample_rate, audio, up, down)
+
+def Test_Harmonics(seconds, sample_rate = 44100):
+	"""
+	Stereo harmonics of 220 Hz up to 21 KHz, with vibrato : phases must stay coherent from one frame to another
+	"""
+	t = np.arange(int(seconds * sample_rate)) / sample_rate
+	audio = sum(0.3 / k * np.sin(2 * np.pi * 220 * k * t + k * np.sin(2 * np.pi * 5 * t)) for k in range(1, 96))
+
+	return np.stack([audio, np.roll(audio, 100)]).astype(np.float32)
+
+def Band_Limited(model, audio, srs = None):
+	"""
+	Stand-in for a MDX model, cut in frames like "demix_base()" : STFT -> only the "dim_f" first bins -> iSTFT
+	"""
+	trim = model.n_fft // 2
+	size = model.chunk_size - 2 * trim
+	frames = -(-audio.shape[1] // size)
+
+	padded = np.zeros((2, frames * size + 2 * trim), dtype=np.float32)
+	padded[:, trim:(trim + audio.shape[1])] = audio
+
+	warp = App.inference.Spectral_SRS(srs, model.n_bins, model.dim_f) if srs is not None else None
+	spec = np.zeros((1, model.dim_c, model.dim_f, model.dim_t), dtype=np.float32)
+	output = np.zeros((2, frames * size), dtype=np.float32)
+
+	for f in range(frames):
+		frame = padded[None, :, (f * size):(f * size + model.chunk_size)]
+		if warp is None:
+			model.Spectrum(frame, spec);  result = spec
+		else:
+			spec_mix = np.zeros((1, model.dim_c, warp.bins_in, model.dim_t), dtype=np.float32)
+			model.Spectrum(frame, spec_mix)
+			warp.Warp(spec_mix, spec);  result = warp.Unwarp(spec)
+
+		output[:, (f * size):((f + 1) * size)] = model.Waveform(result)[0, :, trim:-trim]
+
+	return output[:, :audio.shape[1]], frames
+
+def SRS_Resampled(model, audio, pitch):
+	"""
+	Original SRS of "Extract_with_Model()" : resample, separate, resample back
+	"""
+	audio_SRS, frames = Band_Limited(model, App.audio_utils.Change_sample_rate(audio, pitch, 4))
+	return App.audio_utils.Change_sample_rate(audio_SRS, 4, pitch, out = np.empty(audio.shape, dtype=np.float32)), frames
+
+def SRS_Spectral(model, audio, pitch):
+
+	return Band_Limited(model, audio, pitch / 4)
+
+def SRS():
+	"""
+	Without the real models, quality is measured on the part that SRS has to rebuild :
+	the band above "dim_f" that the model can't give, merged as in "Extract_with_Model()".
+	With a real model, the separation on pitched frames is another story : check the SDR of real songs !
+	"""
+	model = App.inference.Conv_TDF_net_trim_numpy('cpu', 'vocals', 11, {'dim_F_set': 2048, 'dim_T_set': 8, 'N_FFT_scale': 6144})  # "Model 9662"
+	merge = App.audio_utils.Crossover(14600 - 2700, 44100).Merge
+
+	def SDR(reference, estimate):
+		return App.compare.calculate(reference.T[None], estimate.T[None])[0]
+
+	for name, audio in [("noise", Test_Audio(60)), ("harmonics", Test_Harmonics(60))]:
+		source, _ = Band_Limited(model, audio)
+
+		time_1, (srs_1, frames_1) = Timing(SRS_Resampled, model, audio, 6, repeat = 1)
+		time_2, (srs_2, frames_2) = Timing(SRS_Spectral, model, audio, 6, repeat = 1)
+
+		print(f"{f'SRS Spectral ({name}, 6 / 4, 1 min.)':<40} : {time_1:8.3f} sec -> {time_2:8.3f} sec  (x {time_1 / time_2:6.1f})  -  Model frames : {frames_1} -> {frames_2}")
+		print(f"{'':<40}   SDR : {SDR(audio, source):.2f} dB without SRS, {SDR(audio, merge(source, srs_1)):.2f} dB -> {SDR(audio, merge(source, srs_2)):.2f} dB")
+
+if __name__ == '__main__':
+
+	Silent()
+	Ensemble()
+	Pass_filter()
+	Crossover()
+	Spec_Cache()
+	Resample()
+	SRS()
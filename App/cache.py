@@ -0,0 +1,342 @@
+#!python3.10
+
+#   MIT License - Copyright (c) 2023 Captain FLAM
+#
+#   https://github.com/Captain-FLAM/KaraFan
+
+import os, gc, json, shutil, hashlib, tempfile, threading, contextlib, numpy as np
+
+from collections import OrderedDict
+
+try:
+	import psutil
+except ImportError:
+	psutil = None
+
+try:
+	import torch
+except ImportError:
+	torch = None
+
+# VRAM of a model on the GPU, if it can't be measured (its inference buffers are allocated by its first run)
+GPU_MODEL_MB = 1024
+
+# Stages of a song & their exported files (see "Stage_Cache"), in the output folder of this song
+MANIFEST = "KaraFan_stages.json"
+
+def Memory_Used():
+	"""
+	RAM used by this process (0 if "psutil" is not installed)
+	"""
+	return psutil.Process().memory_info().rss if psutil is not None else 0
+
+def GPU_Memory_Used():
+	"""
+	VRAM used on the GPU by all processes (0 if "torch" with CUDA is not installed)
+	"""
+	if torch is None or not torch.cuda.is_available():  return 0
+
+	free, total = torch.cuda.mem_get_info()
+	return total - free
+
+def Audio_Key(audio):
+	"""
+	Identity of an audio content : same samples -> same key (even if it's another array)
+	"""
+	audio = np.ascontiguousarray(audio)
+	digest = hashlib.blake2b(audio.data, digest_size=16).hexdigest()
+
+	return (digest, audio.shape, audio.dtype.str)
+
+class LRU_Cache:
+	"""
+	Arrays kept in RAM up to "max_MB" : the Least Recently Used are removed first.
+
+	"keep_unused" : for items read in the same order by each user (e.g. frames of a song, by each model).
+	With a plain LRU, when all the items don't fit, each one is removed just before the next user needs it !
+	Here, an array never used yet is never removed (the new one is not added),
+	and the arrays already used are removed in the reverse order : each next user gets "max_MB" of them.
+	"""
+	def __init__(self, max_MB, keep_unused = False):
+		self.max_bytes = int(max_MB * 1048576)
+		self.keep_unused = keep_unused
+		self.items = OrderedDict()
+		self.unused = set()
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key):
+		item = self.items.get(key)
+		if item is None:
+			self.misses += 1
+			return None
+
+		self.items.move_to_end(key)
+		self.unused.discard(key)
+		self.hits += 1
+		return item
+
+	def put(self, key, array):
+		if array.nbytes > self.max_bytes:  return
+
+		# Same key -> same content
+		if key in self.items:
+			self.items.move_to_end(key);  return
+
+		if self.keep_unused:
+			# Only the arrays already used can be removed : the Most Recently Used first
+			used = [old_key for old_key in reversed(self.items) if old_key not in self.unused]
+			size = self.size + array.nbytes
+			for old_key in used:
+				if size <= self.max_bytes:  break
+				size -= self.items[old_key].nbytes
+			
+			if size > self.max_bytes:  return
+
+			for old_key in used:
+				if self.size + array.nbytes <= self.max_bytes:  break
+				self.size -= self.items.pop(old_key).nbytes
+
+		self.items[key] = array
+		self.unused.add(key)
+		self.size += array.nbytes
+
+		while self.size > self.max_bytes:
+			old_key, old = self.items.popitem(last=False)
+			self.unused.discard(old_key)
+			self.size -= old.nbytes
+
+	def clear(self):
+		self.items.clear()
+		self.unused.clear()
+		self.size = 0
+		self.hits = 0
+		self.misses = 0
+
+class Model_Pool:
+	"""
+	Loaded models kept in memory up to "max_MB" :
+	the Least Recently Used are unloaded first, and only when a new model needs the room.
+	"gpu" : models run on the GPU, their VRAM is counted too (at least "GPU_MODEL_MB" each)
+	"""
+	def __init__(self, max_MB, gpu = False):
+		self.max_bytes = int(max_MB * 1048576)
+		self.gpu = gpu
+		self.items = OrderedDict()
+		self.sizes = {}
+		self.size = 0
+
+	def __contains__(self, name):
+		return name in self.items
+
+	def __getitem__(self, name):
+		return self.items[name]
+
+	def Get(self, name, Load, min_size = 0):
+		"""
+		"Load" : function that loads the model, only called if it's not in the pool
+		"min_size" : e.g. size of the model file, if the memory used can't be measured
+		"""
+		if name in self.items:
+			self.items.move_to_end(name)
+			return self.items[name]
+
+		if self.gpu:  min_size = max(min_size, GPU_MODEL_MB * 1048576)
+
+		self.Make_Room(min_size)
+
+		before = Memory_Used() + (GPU_Memory_Used() if self.gpu else 0)
+		item = Load()
+		size = max(Memory_Used() + (GPU_Memory_Used() if self.gpu else 0) - before, min_size)
+
+		self.items[name] = item
+		self.sizes[name] = size
+		self.size += size
+
+		# The new model is kept, even if it's bigger than the budget
+		self.Make_Room(0, keep = name)
+		return item
+
+	def Make_Room(self, size, keep = None):
+		while self.items and self.size + size > self.max_bytes:
+			name = next(iter(self.items))
+			if name == keep:  break
+			self.Remove(name)
+
+	def Remove(self, name):
+		if name in self.items:
+			del self.items[name]
+			self.size -= self.sizes.pop(name)
+			gc.collect()
+
+	def Clear(self):
+		for name in list(self.items):  self.Remove(name)
+
+class Scratch:
+	"""
+	Big arrays stored in memory-mapped files, in a temporary folder inside "folder" :
+	the OS keeps in RAM only the parts in use, and pages out the others.
+	"""
+	def __init__(self, folder):
+		os.makedirs(folder, exist_ok=True)
+		self.folder = tempfile.mkdtemp(prefix="KaraFan_", dir=folder)
+		self.count = 0
+		self.temporary = []  # Arrays of each "Temporary()" block
+
+	def Zeros(self, shape, dtype = np.float32):
+		self.count += 1
+		file = os.path.join(self.folder, f"{self.count}.dat")
+
+		array = np.memmap(file, dtype=dtype, mode='w+', shape=shape)  # Filled with zeros
+		if self.temporary:  self.temporary[-1].append(array)
+		return array
+
+	@contextlib.contextmanager
+	def Temporary(self):
+		"""
+		Arrays made by "Zeros()" in this block are only buffers of it : their files are deleted at the end.
+		An array returned by the block stays readable until it's released (except on Windows : deleted by "Clear()")
+		"""
+		self.temporary.append([])
+		try:
+			yield
+		finally:
+			for array in self.temporary.pop():  self.Free(array)
+
+	def Keep(self, array):
+		"""
+		Returns : a memory-mapped copy of "array"
+		"""
+		copy = self.Zeros(array.shape, array.dtype)
+		copy[...] = array
+		return copy
+
+	def Free(self, array):
+		"""
+		Delete the file of an array made by "Zeros()", as soon as it's not needed anymore :
+		the disk space is released when the array is (except on Windows : deleted by "Clear()")
+		"""
+		try:
+			os.remove(array.filename)
+		except OSError:
+			pass  # Windows : still mapped
+
+	def Clear(self):
+		"""
+		Delete the files : arrays still in use stay readable until they are released (except on Windows)
+		"""
+		gc.collect()
+		for file in os.listdir(self.folder):
+			try:
+				os.remove(os.path.join(self.folder, file))
+			except OSError:
+				pass  # Windows : still mapped
+
+	def Close(self):
+		self.Clear()
+		shutil.rmtree(self.folder, ignore_errors=True)
+
+def Stage_Folder(folder = ""):
+	"""
+	Folder of the stage cache : "folder", or by default on the local disk.
+	NOT in Google Drive : it's slow, and a song takes 1 or 2 GB of the user's space !
+	"""
+	if folder != "":  return folder
+
+	local = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser("~"), ".cache")
+	return os.path.join(local, "KaraFan", "Stages")
+
+class Stage_Cache:
+	"""
+	Results of each stage of the separation, kept on disk in ".npy" files up to "max_MB" :
+	the Least Recently Used are deleted first.
+	Raw arrays loaded as memory-mapped files : no decoding, no resampling & no loss (even with MP3 output).
+	"""
+	def __init__(self, folder, max_MB):
+		os.makedirs(folder, exist_ok=True)
+		self.folder = folder
+		self.max_bytes = int(max_MB * 1048576)
+		self.lock = threading.Lock()  # "put" runs in the threads of the writer
+
+	def File(self, key):
+		return os.path.join(self.folder, key + ".npy")
+
+	def __contains__(self, key):
+		return os.path.isfile(self.File(key))
+
+	def get(self, key):
+		"""
+		Returns : a read-only memory-mapped array, or None if not found (or unreadable)
+		"""
+		file = self.File(key)
+		try:
+			array = np.load(file, mmap_mode='r')
+		except (OSError, ValueError):
+			return None
+
+		try:
+			os.utime(file)  # Most Recently Used
+		except OSError:
+			pass
+
+		return array
+
+	def put(self, key, array):
+		if array.nbytes > self.max_bytes:  return
+
+		# Written under another name, then renamed : an interrupted run never leaves a truncated file
+		file = self.File(key)
+		temp = file + ".tmp"
+		with open(temp, 'wb') as output:
+			np.save(output, array)  # Same dtype : float64 results must stay float64, else the next stages would change
+		os.replace(temp, file)
+
+		self.Make_Room()
+
+	def remove(self, key):
+		try:
+			os.remove(self.File(key))
+		except OSError:
+			pass
+
+	def Make_Room(self):
+		with self.lock:
+			self.Delete_LRU()
+
+	def Delete_LRU(self):
+		files = []
+		for entry in os.scandir(self.folder):
+			if entry.name.endswith(".npy"):
+				try:
+					stat = entry.stat()
+				except OSError:
+					continue  # Already gone
+				files.append((stat.st_mtime, stat.st_size, entry.path))
+
+		size = sum(file[1] for file in files)
+		
+		for _, file_size, path in sorted(files):
+			if size <= self.max_bytes:  break
+			try:
+				os.remove(path)
+				size -= file_size
+			except OSError:
+				pass  # Windows : still mapped
+
+def Load_Manifest(folder):
+	"""
+	Returns : { label of a stage : {'index': index in AudioFiles, 'stages': [keys in the stage cache], 'file': exported filename or ""} }
+	"""
+	try:
+		with open(os.path.join(folder, MANIFEST), 'r', encoding='utf-8') as file:
+			return json.load(file)
+	except (OSError, ValueError):
+		return {}
+
+def Save_Manifest(folder, manifest):
+
+	file = os.path.join(folder, MANIFEST)
+	with open(file + ".tmp", 'w', encoding='utf-8') as output:
+		json.dump(manifest, output, indent=1)
+	os.replace(file + ".tmp", file)
@@ -11,7 +11,7 @@ from IPython.display import display, HTML
 
 def Run(Gdrive, Project, isColab, DEV_MODE=False):
 
-	import App.settings, App.inference, App.sys_info, App.progress
+	import App.settings, App.inference, App.sys_info, App.progress, App.cache
 
 	width  = '670px'
 	height = '720px'
@@ -98,13 +98,20 @@ def Run(Gdrive, Project, isColab, DEV_MODE=False):
 	filter_3		= widgets.Dropdown(options = filters, layout = {'width':'200px'}, style=font_input)
 	filter_4		= widgets.Dropdown(options = filters, layout = {'width':'200px'}, style=font_input)
 	# OPTIONS
+	# Any size can be set in the ini file : "auto" (any case), or a number that is not in the list
+	batch_value = config['OPTIONS']['batch_size'].strip()
+	batch_value = str(int(batch_value)) if batch_value.isdigit() and int(batch_value) > 0 else "Auto"
+	batch_sizes = ["Auto"] + sorted({"1", "2", "4", "8", "16", "32", batch_value} - {"Auto"}, key=int)
+
 	normalize		= widgets.Checkbox((config['OPTIONS']['normalize'].lower() == "true"), indent=False, style=font_input, layout=checkbox_layout)
-	large_gpu		= widgets.Checkbox((config['OPTIONS']['large_gpu'].lower() == "true"), indent=False, style=font_input, layout=checkbox_layout)
+	models_RAM_MB	= widgets.IntSlider(int(config['OPTIONS']['models_RAM_MB']), min=0, max=16384, step=512, readout_format = ',d', style=font_input)
 	shifts_vocals	= widgets.IntSlider(int(config['OPTIONS']['shifts_vocals']), min=1, max=24, step=1, style=font_input)
 	shifts_instru	= widgets.IntSlider(int(config['OPTIONS']['shifts_instru']), min=1, max=24, step=1, style=font_input)
 	shifts_filter	= widgets.IntSlider(int(config['OPTIONS']['shifts_filter']), min=1, max=12, step=1, style=font_input)
 	# overlap_MDXv3	= widgets.IntSlider(int(config['OPTIONS']['overlap_MDXv3']), min=2, max=40, step=2, style=font_input)
+	overlap_MDX		= widgets.FloatSlider(float(config['OPTIONS']['overlap_MDX']), min=0.0, max=0.9, step=0.05, readout_format = '.2f', style=font_input)
 	chunk_size		= widgets.IntSlider(int(config['OPTIONS']['chunk_size']), min=100000, max=1000000, step=100000, readout_format = ',d', style=font_input)
+	batch_size		= widgets.Dropdown(value = batch_value, options=batch_sizes, layout = {'width':'100px'}, style=font_input)
 	# BONUS
 	TEST_MODE		= widgets.Checkbox((config['BONUS']['TEST_MODE'].lower() == "true"), indent=False, style=font_input, layout=checkbox_layout)
 	DEBUG			= widgets.Checkbox((config['BONUS']['DEBUG'].lower() == "true"), indent=False, continuous_update=True, style=font_input, layout=checkbox_layout)
@@ -152,12 +159,15 @@ def Run(Gdrive, Project, isColab, DEV_MODE=False):
 				]),
 				separator,
 				widgets.VBox([
-					widgets.HBox([ Label("Normalize input", 301), normalize, Label('Large GPU', 302), large_gpu ]),
+					widgets.HBox([ Label("Normalize input", 301), normalize ]),
+					widgets.HBox([ Label("Models RAM (MB)", 302), models_RAM_MB ]),
 					widgets.HBox([ Label("BigShifts Vocals", 303),  shifts_vocals ]),
 					widgets.HBox([ Label("BigShifts Instrum", 303), shifts_instru ]),
 					widgets.HBox([ Label("BigShifts Filters", 303), shifts_filter ]),
 #					widgets.HBox([ Label("Overlap MDX v3", 304), overlap_MDXv3 ]),
+					widgets.HBox([ Label("Overlap MDX", 304), overlap_MDX ]),
 					widgets.HBox([ Label("Chunk Size", 305), chunk_size ]),
+					widgets.HBox([ Label("Batch Size", 306), batch_size ]),
 				]),
 				separator,
 				widgets.VBox([
@@ -194,15 +204,16 @@ help_index[2][3] = "<b>A.I</b> models : Extract the instrumental part for repair
 help_index[2][4] = "<b>A.I</b> models : Make an Ensemble of extraction with selected models.<br><br>Best combination : « <b>Kim Vocal 2</b> » and « <b>Voc FT</b> »";\
 help_index[2][5] = "<b>A.I</b> models : Pass Vocals trough different filters to remove <b>Bleedings</b> of instruments.<br><br>You have to test various models to find the best combination for your song !";\
 help_index[3][1] = "Normalize input audio files to avoid clipping and get better results.<br><br>Uncheck it for <b>SDR</b> testings !!";\
-help_index[3][2] = "It will load ALL models in GPU memory for faster processing of MULTIPLE audio files.<br>Requires more GB of free GPU memory.<br>Uncheck it if you have memory troubles.";\
+help_index[3][2] = "Memory budget for loaded models. (default : 4,096 MB)<br>On GPU, it covers the GPU memory too : at least 1,024 MB by model !<br><br>Models are kept in memory to be re-used (e.g. as filters, or for the next files),<br>the least recently used are unloaded only when a new one needs the room.<br>Set it to = 0 to keep only one model at a time, <b>if you have memory troubles</b> !";\
 help_index[3][3] = "Set MDX « BigShifts » trick value. (default : 12 , filters : 2)<br><br>Set it to = 1 to disable that feature.";\
-help_index[3][4] = "MDX version 3 overlap. (default : 8)";\
+help_index[3][4] = "Overlap between chunks, with a crossfade. (default : 0.0)<br><br>Use it with a lower « Chunk Size » to save memory without audible boundaries.<br>Closer to 1.0 - slower !";\
 help_index[3][5] = "Chunk size for ONNX models. (default : 500,000)<br><br>Set lower to reduce GPU memory consumption OR <b>if you have GPU memory errors</b> !";\
+help_index[3][6] = "Number of frames sent at once to ONNX models. (default : Auto)<br><br>Memory used doesn\'t depend anymore on the song length, but only on this value.<br>Set lower <b>if you have memory errors</b> !";\
 help_index[4][1] = "IF checked, it will save all intermediate audio files to compare in your <b>Audacity</b>.";\
 help_index[4][2] = "For <b>testing only</b> : Extract with A.I models with 1 pass instead of 2 passes.<br>The quality will be badder (due to weak noise added by MDX models) !<br>The normal <b>TWO PASSES</b> is the same as <b>DENOISE</b> option in <b>UVR 5</b> 😉";\
-help_index[4][3] = "Give you the GOD\'s POWER : each audio file is reloaded IF it was created before,<br>NO NEED to process it again and again !!<br>You\'ll be warned : You have to <b>delete MANUALLY</b> each file that you want to re-process !";\
+help_index[4][3] = "Give you the GOD\'s POWER : the <b>RE-Process</b> buttons.<br>(Each stage processed before with the <b>SAME</b> audio & options is reloaded from the stage cache,<br>with or without GOD MODE : see <b>stage_cache_MB</b> in the Config file)";\
 help_index[4][4] = "Shows an audio player for each saved file. For impatients people ! 😉<br><br>(Preview first 60 seconds with quality of MP3 - VBR 192 kbps)";\
-help_index[4][5] = "With <b>DEBUG</b> & <b>GOD MODE</b> activated : Available with <b>ONE file</b> at a time.<br>Automatic delete audio files of Stem that you want to re-process.<br>Vocals : <b>4_F</b> & <b>5_F</b> & <b>6</b>-Bleedings <b>/</b> Music : <b>same</b> + <b>2</b>-Music_extract & <b>3</b>-Audio_sub_Music";\
+help_index[4][5] = "With <b>GOD MODE</b> activated : Available with <b>ONE file</b> at a time, already processed.<br>Process again the stages of the Stem that you want, even with the same options.<br>Vocals : <b>4</b>-Bleedings & <b>5</b>-Vocal FINAL & <b>6</b>-Music FINAL <b>/</b> Music : <b>same</b> + <b>2</b>-Vocal extract & <b>3</b>-Ensemble Vocal";\
 </script>'))
 
 	# Bug in VS Code : titles NEEDS to be set AFTER children
@@ -265,9 +276,11 @@ help_index[4][5] = "With <b>DEBUG</b> & <b>GOD MODE</b> activated : Available wi
 			'shifts_instru': shifts_instru.value,
 			'shifts_filter': shifts_filter.value,
 #			'overlap_MDXv3': overlap_MDXv3.value,
+			'overlap_MDX': overlap_MDX.value,
 			'chunk_size': chunk_size.value,
+			'batch_size': batch_size.value,
 			'normalize': normalize.value,
-			'large_gpu': large_gpu.value,
+			'models_RAM_MB': models_RAM_MB.value,
 		}
 		config['BONUS'] = {
 			'TEST_MODE': TEST_MODE.value,
@@ -331,41 +344,44 @@ help_index[4][5] = "With <b>DEBUG</b> & <b>GOD MODE</b> activated : Available wi
 		Btn_Create_output.layout.display = 'none'
 		on_output_change({'new': output_path.value})
 	
-	# Delete all vocals files extracted from THIS song
-	def on_Del_Vocals_clicked(b):
+	# Forget the results of these stages for THIS song : they will be processed again, even with the same options
+	# (the next stages too : their inputs will change)
+	def Delete_Stages(indexes):
 
 		# Get the folder based on input audio file's name
 		name = os.path.splitext(os.path.basename(input_path.value))[0]
+		folder = os.path.join(Gdrive, output_path.value, name)
+
+		manifest = App.cache.Load_Manifest(folder)
+		stages = App.cache.Stage_Cache(App.cache.Stage_Folder(config['PERFORMANCE']['stage_folder']), 0)
 
-		deleted = ""		
-		for file_path in sorted(glob.glob(os.path.join(Gdrive, output_path.value, name, "*.*")))[:]:
-			filename = os.path.basename(file_path)
-			if filename.startswith("4") or filename.startswith("5") or filename.startswith("6"):
-				os.remove(file_path);  deleted += filename + ", "
+		deleted = ""
+		for label in sorted(manifest):
+			item = manifest[label]
+			if item['index'] not in indexes:  continue
+
+			for key in item['stages']:  stages.remove(key)
+			
+			if item['file'] != "" and os.path.isfile(os.path.join(folder, item['file'])):
+				os.remove(os.path.join(folder, item['file']));  deleted += item['file'] + ", "
+			
+			del manifest[label]
 		
+		if os.path.isdir(folder):  App.cache.Save_Manifest(folder, manifest)
+
 		if deleted != "":
 			deleted = deleted[:-2]  # Remove last ", "
 			HELP.value = '<div id="HELP">Files deleted : '+ deleted +'</div>'
 		else:
 			HELP.value = '<div id="HELP"><div style="color: #f00">No files to delete !</div></div>'
 
+	# Delete all vocals files extracted from THIS song
+	def on_Del_Vocals_clicked(b):
+		Delete_Stages([4, 5, 6])  # Bleedings in Vocal, Vocal FINAL, Music FINAL
+
 	# Delete all music files extracted from THIS song
 	def on_Del_Music_clicked(b):
-
-		# Get the folder based on input audio file's name
-		name = os.path.splitext(os.path.basename(input_path.value))[0]
-		
-		deleted = ""
-		for file_path in sorted(glob.glob(os.path.join(Gdrive, output_path.value, name, "*.*")))[:]:
-			filename = os.path.basename(file_path)
-			if filename.startswith("2") or filename.startswith("3") or filename.startswith("4") or filename.startswith("5") or filename.startswith("6"):
-				os.remove(file_path);  deleted += filename + ", "
-		
-		if deleted != "":
-			deleted = deleted[:-2]  # Remove last ", "
-			HELP.value = '<div id="HELP">Files deleted : '+ deleted +'</div>'
-		else:
-			HELP.value = '<div id="HELP"><div style="color: #f00">No files to delete !</div></div>'
+		Delete_Stages([2, 3, 4, 5, 6])  # + Vocal extract, Ensemble Vocal
 
 	# Link Buttons to functions
 	Btn_Create_input.on_click(on_Create_input_clicked)
@@ -420,7 +436,10 @@ help_index[4][5] = "With <b>DEBUG</b> & <b>GOD MODE</b> activated : Available wi
 		
 	def on_GOD_MODE_change(change):
 		path = os.path.join(Gdrive, input_path.value)
-		disable = not (os.path.isfile(path) and DEBUG.value and GOD_MODE.value)
+		name = os.path.splitext(os.path.basename(path))[0]
+		
+		# Only if this song was already processed
+		disable = not (os.path.isfile(path) and GOD_MODE.value and os.path.isfile(os.path.join(Gdrive, output_path.value, name, App.cache.MANIFEST)))
 		Btn_Del_Vocals.disabled = disable
 		Btn_Del_Music.disabled  = disable
 
@@ -449,6 +468,8 @@ help_index[4][5] = "With <b>DEBUG</b> & <b>GOD MODE</b> activated : Available wi
 		else:
 			Btn_Create_output.layout.display = 'none'
 
+		on_GOD_MODE_change(change)  # The RE-Process buttons depend on the output folder
+
 	# Link Events to functions
 	input_path.observe(on_input_change, names='value')
 	output_path.observe(on_output_change, names='value')
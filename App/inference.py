@@ -11,12 +11,18 @@
 #   https://github.com/Captain-FLAM/KaraFan
 
 
-import os, gc, io, sys, csv, base64, argparse, requests
+import os, gc, io, sys, csv, base64, hashlib, argparse, contextlib, requests
 import regex as re
 import numpy as np
 import onnxruntime as ort
-import torch, torch.nn as nn
 
+# PyTorch is optional : only used for STFT / iSTFT (see "Conv_TDF_net_trim_numpy")
+try:
+	import torch, torch.nn as nn
+except ImportError:
+	torch = nn = None
+
+import scipy.fft, scipy.sparse
 import librosa, soundfile as sf
 from pydub import AudioSegment
 
@@ -28,11 +34,10 @@ from time import time
 
 import ipywidgets as widgets
 from IPython.display import display, HTML
-import contextlib
 # from tqdm.auto import tqdm  # Auto : Progress Bar in GUI with ipywidgets
 # from tqdm.contrib import DummyTqdmFile
 
-import App.settings, App.audio_utils, App.compare
+import App.settings, App.audio_utils, App.compare, App.onnx_utils, App.cache, App.parallel, App.pipeline
 
 # from App.tfc_tdf_v3 import TFC_TDF_net
 
@@ -40,12 +45,105 @@ EXTRACT_VOCALS = 1
 EXTRACT_INSTRU = 2
 FILTER_AUDIO = 3
 
-class Conv_TDF_net_trim_model(nn.Module):
+# Polarity of the audio sent to MDX models (see "Extract_with_Model()")
+PAIRED_POLARITY = 0
+
+# Threads used by NumPy STFT (-1 = all cores, less in worker processes)
+FFT_THREADS = -1
+
+# Streaming mode : seconds of audio added on each side of a block (see "Stream_Blocks()")
+STREAM_MARGIN = 5
+
+# Version of the recipe in the keys of the stage cache : increase it when the recipe changes,
+# so the results of the older one are not reloaded anymore !
+STAGES_VERSION = 1
+
+class Buffer_Arena:
+	"""
+	Buffers reused from one micro-batch to another (one arena for each model) :
+	steady-state processing of a chunk allocates (almost) nothing.
+	A buffer is re-allocated only if it becomes too small.
+	"""
+	def __init__(self, device):
+		self.device = device
+		self.buffers = {}
+
+	def numpy(self, name, shape):
+		size = int(np.prod(shape))
+		buffer = self.buffers.get(name)
+		if buffer is None or buffer.size < size:
+			buffer = self.buffers[name] = np.zeros(size, dtype=np.float32)
+		
+		return buffer[:size].reshape(shape)
+
+	def tensor(self, name, shape):
+		size = int(np.prod(shape))
+		buffer = self.buffers.get(name)
+		if buffer is None or buffer.numel() < size:
+			buffer = self.buffers[name] = torch.zeros(size, dtype=torch.float32, device=self.device)
+		
+		return buffer[:size].view(shape)
+
+
+class Spectral_SRS:
+	"""
+	Experimental SRS without resampling : the spectrogram of the mix is stretched along the frequency axis,
+	as if the audio was resampled by "ratio" (5/4 or 6/4), and the result of the model is shrunk back.
+	Frames stay the same (no time stretching) : the model sees the same frames, only pitched down.
+
+	Bins are interpolated linearly, after a phase shift of half a frame ((-1)^k, window centered),
+	else 2 neighbor bins of the same sinusoid would cancel each other.
+	"""
+	def __init__(self, ratio, n_bins, dim_f):
+		self.ratio = ratio
+
+		# Mix (n_bins of the model) -> input of the model (dim_f)
+		self.bins_in = min(n_bins, int((dim_f - 1) * ratio) + 2)
+		self.warp = Spectral_Interpolation(np.arange(dim_f) * ratio, self.bins_in)
+
+		# Output of the model (dim_f) -> result (n_bins of the model)
+		self.bins_out = min(n_bins, int((dim_f - 1) * ratio) + 1)
+		self.unwarp = Spectral_Interpolation(np.arange(self.bins_out) / ratio, dim_f)
+
+	def Warp(self, spec, out):
+		"""
+		(batch, 4, bins_in, dim_t) -> "out" (batch, 4, dim_f, dim_t)
+		"""
+		for b in range(spec.shape[0]):
+			for c in range(spec.shape[1]):  out[b, c] = self.warp @ spec[b, c]
+
+	def Unwarp(self, spec):
+		"""
+		(batch, 4, dim_f, dim_t) -> (batch, 4, bins_out, dim_t)
+		"""
+		out = np.empty((spec.shape[0], spec.shape[1], self.bins_out, spec.shape[3]), dtype=np.float32)
+		for b in range(spec.shape[0]):
+			for c in range(spec.shape[1]):  out[b, c] = self.unwarp @ spec[b, c]
+		
+		return out
+
+def Spectral_Interpolation(positions, length):
+	"""
+	Linear interpolation of bins at fractional "positions" (zero beyond "length"), with the phase shift of "Spectral_SRS"
+	Returns : sparse matrix (positions, length) -> only 2 bins for each row
+	"""
+	index  = np.minimum(positions.astype(np.int64), length - 2)
+	weight = positions - index
+	sign   = np.where((np.arange(len(positions)) + index) % 2 == 0, 1.0, -1.0)
+	inside = positions <= length - 1
+
+	rows = np.arange(len(positions))
+	data = np.concatenate([(1.0 - weight) * sign * inside, -weight * sign * inside]).astype(np.float32)
+
+	return scipy.sparse.csr_matrix((data, (np.concatenate([rows, rows]), np.concatenate([index, index + 1]))), shape=(len(positions), length))
+
+class Conv_TDF_net_trim_model(nn.Module if nn else object):
 
 	def __init__(self, device, target_stem, neuron_blocks, model_params, hop=1024):
 
 		super(Conv_TDF_net_trim_model, self).__init__()
 		
+		self.device = device
 		self.dim_c = 4
 		self.dim_f = model_params['dim_F_set']
 		self.dim_t = 2 ** model_params['dim_T_set']
@@ -58,21 +156,30 @@ class Conv_TDF_net_trim_model(nn.Module):
 
 		out_c = self.dim_c * 4 if target_stem == '*' else self.dim_c
 		self.freq_pad = torch.zeros([1, out_c, self.n_bins - self.dim_f, self.dim_t]).to(device)
+		self.freq_pads = {}  # Cached for each batch size
+
+		self.arena = Buffer_Arena(device)
 		
   		# Only used by "forward()" method
 		# self.n = neuron_blocks // 2
 
-	def stft(self, x):
+	def stft(self, x, bins=None):
 		x = x.reshape([-1, self.chunk_size])
 		x = torch.stft(x, n_fft=self.n_fft, hop_length=self.hop, window=self.window, center=True, return_complex=True)
 		x = torch.view_as_real(x)
 		x = x.permute([0, 3, 1, 2])
 		x = x.reshape([-1, 2, 2, self.n_bins, self.dim_t]).reshape([-1, self.dim_c, self.n_bins, self.dim_t])
-		return x[:, :, :self.dim_f]
+		return x[:, :, :(bins or self.dim_f)]
 
 	def istft(self, x, freq_pad=None):
-		freq_pad = self.freq_pad.repeat([x.shape[0], 1, 1, 1]) if freq_pad is None else freq_pad
-		x = torch.cat([x, freq_pad], -2)
+		# Not needed if "x" is already padded up to "n_bins"
+		if x.shape[2] < self.n_bins:
+			if freq_pad is None:
+				freq_pad = self.freq_pads.get(x.shape[0])
+				if freq_pad is None:
+					freq_pad = self.freq_pads[x.shape[0]] = self.freq_pad.repeat([x.shape[0], 1, 1, 1])
+			
+			x = torch.cat([x, freq_pad], -2)
 		x = x.reshape([-1, 2, 2, self.n_bins, self.dim_t]).reshape([-1, 2, self.n_bins, self.dim_t])
 		x = x.permute([0, 2, 3, 1])
 		x = x.contiguous()
@@ -80,6 +187,27 @@ class Conv_TDF_net_trim_model(nn.Module):
 		x = torch.istft(x, n_fft=self.n_fft, hop_length=self.hop, window=self.window, center=True)
 		return x.reshape([-1, 2, self.chunk_size])
 
+	def Spectrum(self, frames, out):
+		"""
+		NumPy in & out : (batch, 2, chunk_size) -> "out" (batch, 4, dim_f, dim_t)
+		"out" can have more bins than "dim_f" (see "Spectral_SRS")
+		"""
+		with torch.no_grad():
+			torch.from_numpy(out).copy_(self.stft(torch.from_numpy(frames).to(self.device), out.shape[2]))
+
+	def Waveform(self, spec):
+		"""
+		NumPy in & out : (batch, 4, dim_f, dim_t) -> (batch, 2, chunk_size)
+		"spec" can have more bins than "dim_f" (see "Spectral_SRS")
+		"""
+		bins = spec.shape[2]
+		with torch.no_grad():
+			# Padded up to "n_bins" : the padding is never written, it stays at zero (1 buffer for each number of bins)
+			spec_full = self.arena.tensor(f'spec_full_{bins}', (spec.shape[0], self.dim_c, self.n_bins, self.dim_t))
+			spec_full[:, :, :bins].copy_(torch.from_numpy(spec))
+
+			return self.istft(spec_full).cpu().numpy()
+
 	# Not used : only for training Models !
 	#
 	# def forward(self, x):
@@ -102,11 +230,89 @@ class Conv_TDF_net_trim_model(nn.Module):
 	# 	x = self.final_conv(x)
 	# 	return x
 
-def get_models(device, model_params, stem):
+class Conv_TDF_net_trim_numpy:
+	"""
+	Same STFT / iSTFT as "Conv_TDF_net_trim_model", with NumPy & SciPy only (no PyTorch needed)
+	"""
+	def __init__(self, device, target_stem, neuron_blocks, model_params, hop=1024):
+
+		self.device = device
+		self.dim_c = 4
+		self.dim_f = model_params['dim_F_set']
+		self.dim_t = 2 ** model_params['dim_T_set']
+		self.n_fft = model_params['N_FFT_scale']
+		self.hop = hop
+		self.n_bins = self.n_fft // 2 + 1
+		self.chunk_size = hop * (self.dim_t - 1)
+		self.target_stem = target_stem
+
+		# Same as torch.hann_window(periodic=True)
+		self.window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(self.n_fft) / self.n_fft)).astype(np.float32)
+
+		# Overlap-Add : frames are cut in blocks of "hop" samples
+		self.n_blocks = -(-self.n_fft // hop)
+
+		# iSTFT normalization by the sum of squared windows (as torch.istft), without the center padding
+		envelope = np.zeros((self.dim_t - 1 + self.n_blocks) * hop, dtype=np.float32)
+		for t in range(self.dim_t):
+			envelope[t * hop : t * hop + self.n_fft] += self.window ** 2
+		self.envelope = envelope[self.n_fft // 2 : self.n_fft // 2 + self.chunk_size]
+
+		self.arena = Buffer_Arena(device)
+
+	def Spectrum(self, frames, out):
+		"""
+		(batch, 2, chunk_size) -> "out" (batch, 4, dim_f, dim_t)
+		"out" can have more bins than "dim_f" (see "Spectral_SRS")
+		"""
+		batch = frames.shape[0];  bins = out.shape[2]
+		x = frames.reshape([-1, self.chunk_size])
+		x = np.pad(x, ((0, 0), (self.n_fft // 2, self.n_fft // 2)), mode='reflect')  # center = True
+		x = np.lib.stride_tricks.sliding_window_view(x, self.n_fft, axis=-1)[:, ::self.hop]  # (batch * 2, dim_t, n_fft)
+		x = scipy.fft.rfft(x * self.window, axis=-1, workers=FFT_THREADS)[:, :, :bins]
+		x = x.reshape([batch, 2, self.dim_t, bins]).transpose([0, 1, 3, 2])
+
+		# Channels : Left (real, imag), Right (real, imag)
+		out = out.reshape([batch, 2, 2, bins, self.dim_t])
+		out[:, :, 0] = x.real
+		out[:, :, 1] = x.imag
+
+	def Waveform(self, spec):
+		"""
+		(batch, 4, dim_f, dim_t) -> (batch, 2, chunk_size)
+		"spec" can have more bins than "dim_f" (see "Spectral_SRS")
+		"""
+		batch = spec.shape[0];  bins = spec.shape[2]
+		spec = spec.reshape([batch * 2, 2, bins, self.dim_t]).transpose([0, 3, 2, 1])  # (batch * 2, dim_t, bins, 2)
+
+		# Padded up to "n_bins"
+		x = np.zeros([batch * 2, self.dim_t, self.n_bins], dtype=np.complex64)
+		x[:, :, :bins].real = spec[..., 0]
+		x[:, :, :bins].imag = spec[..., 1]
+		x = scipy.fft.irfft(x, n=self.n_fft, axis=-1, workers=FFT_THREADS)
+		x *= self.window
+
+		# Overlap-Add, block by block
+		frames = self.arena.numpy('frames', (batch * 2, self.dim_t, self.n_blocks * self.hop))
+		frames[:, :, :self.n_fft] = x
+		frames[:, :, self.n_fft:] = 0.0
+		frames = frames.reshape([batch * 2, self.dim_t, self.n_blocks, self.hop])
+
+		y = self.arena.numpy('ola', (batch * 2, self.dim_t - 1 + self.n_blocks, self.hop))
+		y[:] = 0.0
+		for b in range(self.n_blocks):
+			y[:, b : b + self.dim_t] += frames[:, :, b]
+
+		y = y.reshape([batch * 2, -1])[:, self.n_fft // 2 : self.n_fft // 2 + self.chunk_size]
+		y = y / self.envelope
+		return y.reshape([batch, 2, self.chunk_size])
+
+def get_models(device, model_params, stem, backend='torch'):
 	# ??? NOT so simple ... ???
 	# FFT = 7680  --> Narrow Band
 	# FFT = 6144  --> FULL Band
-	model = Conv_TDF_net_trim_model(
+	Model = Conv_TDF_net_trim_model if backend == 'torch' else Conv_TDF_net_trim_numpy
+	model = Model(
 		device,
 		# I suppose you can use '*' to get both vocals and instrum, with the new MDX23C model ...
 		'vocals' if stem == 'Vocals' else 'instrum',
@@ -194,48 +400,148 @@ def get_models(device, model_params, stem):
 
 # 	return sources
 
-def demix_base(mix, device, models, infer_session):
+def Auto_Batch_size(model, device):
+	"""
+	Number of frames sent to ONNX at once, to keep each micro-batch around a fixed memory budget
+	"""
+	budget = 512 if device == 'cpu' else 1024  # MB
+
+	# STFT input + ONNX output + iSTFT (padded to "n_bins") for ONE frame (float32)
+	frame_size = 4 * model.dim_c * model.n_bins * model.dim_t * 4 / 1048576  # MB
+
+	return max(1, int(budget // frame_size))
+
+def demix_base(mixes, device, models, infer_session, batch_size = 0, polarity = 1, cache = None, keys = None, srs = None):
+	"""
+	"mixes" : list of audio parts of the SAME length (e.g. the rolled mixes of all BigShifts),
+	their frames are sent together to ONNX, by micro-batches of "batch_size" (0 = Auto),
+	and written straight into the output buffer : peak memory doesn't depend on the song length.
+
+	"polarity" :
+	   1 : normal pass
+	  -1 : phase-inverted pass -> the phase of the result is restored
+	   PAIRED_POLARITY : both passes stacked in the SAME ONNX batch -> 0.5 * (-inverted + normal)
+	
+	"cache" & "keys" : identity of each mix, to reuse the spectrograms of its frames
+	if they were already computed by another model with the same FFT geometry, or for another polarity.
+
+	"srs" : ratio of the Spectral SRS (see "Spectral_SRS"), None = normal pass
+
+	Returns : for each model, an array of (mixes, 2, samples) that belongs to its buffer arena,
+	so it's only valid until the next call !
+	"""
 	sources = []
-	n_sample = mix.shape[1]
+	n_mixes  = len(mixes)
+	n_sample = mixes[0].shape[1]
+	input_name  = infer_session.get_inputs()[0].name
+	output_name = infer_session.get_outputs()[0].name
+
+	# Model with STFT & iSTFT included (see "onnx_utils.py") : waveform in -> waveform out
+	wave_io = (input_name == 'waveform')
+	if wave_io or keys is None:  cache = None
+
 	for model in models:
 		trim = model.n_fft // 2
 		gen_size = model.chunk_size - 2 * trim
 		pad = gen_size - n_sample % gen_size
-		mix_p = np.concatenate(
-			(
-				np.zeros((2, trim)),
-				mix,
-				np.zeros((2, pad)),
-				np.zeros((2, trim))
-			), 1
-		)
-
-		mix_waves = []
-		i = 0
-		while i < n_sample + pad:
-			waves = np.array(mix_p[:, i:i + model.chunk_size])
-			mix_waves.append(waves)
-			i += gen_size
-		mix_waves = np.array(mix_waves)
-		mix_waves = torch.tensor(mix_waves, dtype=torch.float32).to(device)
+
+		n_frames = (n_sample + pad) // gen_size
+		total = n_mixes * n_frames
+		batch = batch_size if batch_size > 0 else Auto_Batch_size(model, device)
+
+		# Both polarities of a frame are in the same batch
+		n_pass = 2 if polarity == PAIRED_POLARITY else 1
+		if n_pass == 2:  batch = max(1, batch // 2)
+
+		warp = Spectral_SRS(srs, model.n_bins, model.dim_f) if srs is not None and not wave_io else None
+
+		arena = model.arena
+		tar_signal = arena.numpy('sources', (n_mixes, 2, n_frames * gen_size))
 
 		try:
-			with torch.no_grad():
-				_ort = infer_session
-				stft_res = model.stft(mix_waves)
-				res = _ort.run(None, {'input': stft_res.cpu().numpy()})[0]
-				ten = torch.tensor(res)
-				tar_waves = model.istft(ten.to(device))
-				tar_waves = tar_waves.cpu()
-				tar_signal = tar_waves[:, :, trim:-trim].transpose(0, 1).reshape(2, -1).numpy()[:, :-pad]
+			io_binding = infer_session.io_binding()
+
+			for first in range(0, total, batch):
+				count = min(batch, total - first)
+
+				# Frames are views on the mixes : only ONE copy into the batch buffer,
+				# with zero padding of "trim" samples at both ends, and of "pad" samples at the end
+				# (in the last "count" frames : the first ones are for the inverted pass, if any)
+				mix_waves = arena.numpy('waves', (n_pass * count, 2, model.chunk_size))
+				frames = mix_waves[(n_pass - 1) * count:]
 
-			sources.append(tar_signal)
+				if wave_io:
+					data_in = mix_waves
+				else:
+					data_in = arena.numpy('spec_in', (n_pass * count, model.dim_c, model.dim_f, model.dim_t))
+					spec = data_in[(n_pass - 1) * count:]
+
+				# Spectrograms of the normal polarity, already computed ?
+				cached = None
+				if cache is not None:
+					spec_keys = [keys[k // n_frames] + (k % n_frames, model.n_fft, model.dim_f, model.dim_t, srs) for k in range(first, first + count)]
+					cached = [cache.get(key) for key in spec_keys]
+					if any(item is None for item in cached):  cached = None
+
+				if cached is not None:
+					for f in range(count):  spec[f] = cached[f]
+				else:
+					for f in range(count):
+						k = first + f
+						mix = mixes[k // n_frames]
+						i = (k % n_frames) * gen_size - trim
+						start = max(i, 0);  end = min(i + model.chunk_size, n_sample)
+						frames[f, :, :start - i] = 0.0
+						frames[f, :, start - i : end - i] = mix[:, start:end]
+						frames[f, :, end - i:] = 0.0
+					
+					if warp is not None:
+						spec_mix = arena.numpy('spec_srs', (count, model.dim_c, warp.bins_in, model.dim_t))
+						model.Spectrum(frames, spec_mix)
+						warp.Warp(spec_mix, spec)
+					elif not wave_io:
+						model.Spectrum(frames, spec)
+
+					# Warped spectrograms too : the "srs" ratio is in their keys
+					if cache is not None:
+						for f in range(count):  cache.put(spec_keys[f], spec[f].copy())
+
+				# STFT is linear : STFT(-x) = -STFT(x) --> computed only once
+				if n_pass == 2:
+					np.negative(data_in[count:], out=data_in[:count])
+				elif polarity < 0:
+					np.negative(data_in, out=data_in)
+				
+				# ONNX writes directly into the output buffer
+				data_out = arena.numpy('data_out', data_in.shape)
+				io_binding.bind_cpu_input(input_name, data_in)
+				io_binding.bind_output(output_name, 'cpu', 0, np.float32, list(data_out.shape), data_out.ctypes.data)
+				infer_session.run_with_iobinding(io_binding)
+
+				# iSTFT is linear too : restore the phase & combine the 2 passes BEFORE it
+				if n_pass == 2:
+					res = data_out[count:]
+					np.subtract(res, data_out[:count], out=res)
+					res *= 0.5
+				else:
+					res = data_out
+					if polarity < 0:  np.negative(res, out=res)
+				
+				if warp is not None:  res = warp.Unwarp(res)
+
+				tar_waves = res if wave_io else model.Waveform(res)
+
+				for f in range(count):
+					k = first + f;  i = (k % n_frames) * gen_size
+					tar_signal[k // n_frames, :, i : i + gen_size] = tar_waves[f, :, trim:-trim]
+		
+			sources.append(tar_signal[:, :, :n_sample])
 
 		except Exception as e:
-			print("\n\nError in demix_base() with Torch : ", e)
+			print("\n\nError in demix_base() : ", e)
 			Exit_Notebook()
 	
-	return np.array(sources)
+	return sources
 
 
 class MusicSeparationModel:
@@ -275,16 +581,55 @@ class MusicSeparationModel:
 		self.shifts_instru	= options['shifts_instru']
 		self.shifts_filter	= options['shifts_filter']
 #		self.overlap_MDXv3	= int(options['overlap_MDXv3'])
+		self.overlap_MDX	= options['overlap_MDX']
 		self.normalize		= options['normalize']
-		self.large_gpu		= options['large_gpu']
+		self.models_RAM_MB	= options['models_RAM_MB']
+		self.batch_size		= options['batch_size']  # 0 = Auto
+		self.batch_shifts	= options['batch_shifts']
+		self.paired_polarity	= options['paired_polarity']
+		self.onnx_stft			= options['onnx_stft']
+		self.srs_spectral		= options['srs_spectral']
+		self.parallel_workers	= options['parallel_workers']  # 0 = disabled
+
+		# Audio files written in background (0 = disabled)
+		self.writer = App.pipeline.Writer(options['audio_writers']) if options['audio_writers'] > 0 else None
+		self.extracted			= {}  # Results of parallel extractions
+
+		# Songs longer than "stream_minutes" are processed by blocks of "stream_block" seconds (0 = disabled)
+		self.stream_minutes		= options['stream_minutes']
+		self.stream_block		= max(2 * STREAM_MARGIN, options['stream_block'])
+		self.stream				= None  # State of the song being streamed
+		self.manifest			= None  # Stages of the song being processed
+		self.exported			= {}  # Manifest of its previous run
+
+		# Big intermediate arrays in memory-mapped files (empty = in RAM)
+		self.scratch = App.cache.Scratch(options['scratch_folder']) if options['scratch_folder'] != "" else None
+
+		# Results of each stage kept on disk, reloaded by the next runs with the same input & options (0 = disabled)
+		self.stages = App.cache.Stage_Cache(App.cache.Stage_Folder(options['stage_folder']), options['stage_cache_MB']) if options['stage_cache_MB'] > 0 else None
+
+		# Spectrograms of the input shared between models (0 = disabled)
+		self.spec_cache = App.cache.LRU_Cache(options['spec_cache_MB'], keep_unused = True) if options['spec_cache_MB'] > 0 else None
+
+		# SRS resampled inputs shared between models (a few songs at most)
+		self.resample_cache = App.cache.LRU_Cache(1024)
+		self.stft_backend		= options['stft_backend'].lower()
+
+		if self.stft_backend == 'torch' and torch is None:
+			print('PyTorch is not installed : NumPy is used for STFT instead.')
+			self.stft_backend = 'numpy'
+		elif self.stft_backend not in ['torch', 'numpy']:
+			self.stft_backend = 'torch' if torch is not None else 'numpy'
 
 		self.DEBUG		= options['DEBUG']
 		self.TEST_MODE	= options['TEST_MODE']
-		self.GOD_MODE	= options['GOD_MODE']
 		self.PREVIEWS	= options['PREVIEWS']
 			
 		self.device = 'cpu'
-		if torch.cuda.is_available():  self.device = 'cuda:0'
+		if torch is not None:
+			if torch.cuda.is_available():  self.device = 'cuda:0'
+		elif 'CUDAExecutionProvider' in ort.get_available_providers():
+			self.device = 'cuda:0'  # GPU for ONNX only
 		print("Use device -> " + self.device.upper())
 		
 		if self.device == 'cpu':
@@ -297,19 +642,26 @@ class MusicSeparationModel:
 			self.chunk_size = 1000000
 			self.providers = ["CUDAExecutionProvider"]
 
+			if self.parallel_workers > 0:
+				print("Parallel workers are only for CPU : disabled.")
+				self.parallel_workers = 0
+
 		if 'chunk_size' in options:
 			self.chunk_size = int(options['chunk_size'])
 		
 #		if self.overlap_MDXv3 > 40:		self.overlap_MDXv3 = 40
 #		if self.overlap_MDXv3 < 1:		self.overlap_MDXv3 = 1
 
+		if self.overlap_MDX > 0.9:		self.overlap_MDX = 0.9
+		if self.overlap_MDX < 0.0:		self.overlap_MDX = 0.0
+
 #		if self.bigshifts_MDX > 41:		self.bigshifts_MDX = 41
 #		if self.bigshifts_MDX < 1:		self.bigshifts_MDX = 1
 
 		# MDX-B models initialization
 
 		self.models = { 'vocals': [], 'instrum': [], 'filters': [] }
-		self.MDX = {}
+		self.MDX = App.cache.Model_Pool(self.models_RAM_MB, gpu = ('CUDAExecutionProvider' in self.providers))  # Loaded models (RAM & VRAM)
 
 		# Load Models parameters
 		with open(os.path.join(options['Project'], "App", "Models_DATA.csv")) as csvfile:
@@ -345,21 +697,15 @@ class MusicSeparationModel:
 				model['dim_T_set']		= int(model['dim_T_set'])
 				
 				model['PATH'] = Download_Model(model, models_path, self.CONSOLE, self.Progress)
-		
-		# Load Models
-		if self.large_gpu: 
-			print("Large GPU mode is enabled : Loading models now...")
-
-			for stem in self.models:
-				for model in self.models[stem]:  self.Load_MDX(model)
 	
 	# ******************************************************************
 	# ****    This is the MAGIC RECIPE , the heart of KaraFan !!    ****
 	# ******************************************************************
 
-	def SEPARATE(self, file):
+	def SEPARATE(self, file, decoded = None):
 		"""
 		Implements the sound separation for a single sound file
+		"decoded" : (audio, sample_rate) already decoded by "Load_Audio()", if any
 		"""
 		
 		name = os.path.splitext(os.path.basename(file))[0]
@@ -372,28 +718,192 @@ class MusicSeparationModel:
 		self.song_output_path = os.path.join(self.output, name)
 		if not os.path.exists(self.song_output_path): os.makedirs(self.song_output_path)
 		
-		# TODO : sr = None --> uses the native sampling rate (if 48 Khz or 96 Khz), maybe not good for MDX models ??
-		original_audio, self.sample_rate = librosa.load(file, mono=False, sr = 44100)  # Resample to 44.1 Khz
+		# Stages of this song (see "Record_Stage()"), and the ones of the previous run
+		self.manifest = {} if self.stages is not None else None
+		self.exported = App.cache.Load_Manifest(self.song_output_path) if self.stages is not None else {}
+
+		# Very long song : processed block by block
+		if decoded is None and self.Is_Streamed(file):
+			self.SEPARATE_Stream(file)
+		else:
+			original_audio, self.sample_rate = decoded if decoded is not None else Load_Audio(file)
+
+			print(f"Input audio : {original_audio.shape} - Sample rate : {self.sample_rate}")
+
+			self.Separate_Audio(original_audio)
 		
-		# Convert mono to stereo (if needed)
-		if len(original_audio.shape) == 1:
-			original_audio = np.stack([original_audio, original_audio], axis=0)
+		if self.scratch is not None:  self.scratch.Clear()
+
+		self.Update_Manifest()
 
-		print(f"Input audio : {original_audio.shape} - Sample rate : {self.sample_rate}")
+		#**********************************
+		#****  TESTING for DEVELOPERS  ****
+		#**********************************
+		
+		# The "song_output_path" contains the NAME of the song to compare within the "Multi-Song" folder
+		# That's all !!
+		if name.startswith("SDR_"):
+
+			print("----------------------------------------")
+			if self.writer is not None:  self.writer.Flush()
+			App.compare.SDR(self.song_output_path, self.Options['Gdrive'])
+		
+			# And to Re-process immediately a file :
+			#os.remove(os.path.join(self.song_output_path, "2 - Vocal extract - (Kim Vocal 2).flac"))
+			
+			# OR all files :
+			#for file in os.listdir(self.song_output_path):
+			#	os.remove(os.path.join(self.song_output_path, file))
+
+		# TESTS - Examples (with old version of KaraFan 1.0)
+		
+		# instrum = instrum / self.model_instrum['Compensation']
+		# self.Save_Audio("Sub - 1", normalized - (instrum * 1.0235))
+		# self.Save_Audio("Sub - 2", normalized - (instrum * 1.0240))
+		# self.Save_Audio("Sub - 3", normalized - (instrum * 1.0245))
+
+		# vocals_final = vocals_final / self.model_vocals['Compensation']
+		# instrum_final_1 = normalized - (vocals_final * 1.0082)
+		# instrum_final_2 = normalized - (vocals_final * 1.0085)
+		# instrum_final_3 = normalized - (vocals_final * 1.0088)
+		# self.Save_Audio("Music - Test 1", instrum_final_1)
+		# self.Save_Audio("Music - Test 2", instrum_final_2)
+		# self.Save_Audio("Music - Test 3", instrum_final_3)
+
+	def Is_Streamed(self, file):
+		return self.stream_minutes > 0 and Stream_Duration(file) > self.stream_minutes * 60
+
+	def SEPARATE_Stream(self, file):
+		"""
+		Same separation, block by block : memory stays the same, whatever the length of the song.
+		Each output file is written block after block (see "Save_Audio()").
+		"""
+		duration = Stream_Duration(file)
+		blocks = int(np.ceil(duration / self.stream_block))
+
+		print(f"Input audio : {duration / 60:.1f} min. -> Streaming mode : {blocks} blocks of {self.stream_block} sec.")
+
+		if self.Options['output_format'] == 'MP3':
+			print("MP3 can't be written block by block : FLAC is used instead.")
+
+		self.sample_rate = 44100  # Same as "Load_Audio()"
+		self.stream = {
+			'files': {},
+			'stats': None,
+			# Only 1 thread : blocks MUST be written in order !
+			'writer': App.pipeline.Writer(1) if self.writer is not None else None,
+		}
+		try:
+			# 1st pass : peak of the WHOLE song
+			if self.normalize:
+				print("► Normalizing audio (analysis)")
+				self.stream['stats'] = App.audio_utils.Normalize_Stats(
+					audio[:, start:(start + length)] for audio, start, length in Stream_Blocks(file, self.stream_block, 0))
+
+			for index, (audio, start, length) in enumerate(Stream_Blocks(file, self.stream_block)):
+				
+				print(f"► Block {index + 1} / {blocks}")
+
+				self.stream['crop'] = (start, length)
+				self.Separate_Audio(audio)
+
+				if self.scratch is not None:  self.scratch.Clear()
+		finally:
+			# Each resource is released, even if another one fails (e.g. a block that can't be written)
+			stream, self.stream = self.stream, None
+			try:
+				if stream['writer'] is not None:  stream['writer'].Close()
+			finally:
+				errors = []
+				for sound in stream['files'].values():
+					try:
+						sound.close()
+					except Exception as e:
+						errors.append(e)
+
+				if errors:  raise errors[0]
+
+	def Separate_Audio(self, original_audio):
+		"""
+		The MAGIC RECIPE itself, for a whole song OR a block of it (see "SEPARATE_Stream()")
+		"""
+		# New song
+		if self.spec_cache is not None:  self.spec_cache.clear()
+		self.resample_cache.clear()
 		
 		# ****  START PROCESSING  ****
 
-		if self.normalize:
-			normalized = self.Check_Already_Processed(0)
+		# Stages of the recipe, each one with the fingerprint of its inputs & options (see "Stage_Key()") :
+		#
+		#   0 NORMALIZED  -->  1 & 2 Extracts  -->  3 Ensemble Vocal  -->  4 Bleedings  -->  5 & 6 FINALs
+		#
+		# A changed option invalidates only the next stages : all the previous ones are reloaded.
+		# And fingerprints are known BEFORE any processing : a stage is got only if its file must be exported,
+		# or if a next stage to compute needs it (e.g. Extracts removed from the stage cache are NOT extracted again if the FINALs are still there).
+
+		source = self.Stage_Source(original_audio)
+
+		normalized_stage = self.Stage_Key(0, [source]) if self.normalize else source
+		instrum_stages	= [self.Stage_Key(1, [normalized_stage], model) for model in self.models['instrum']]
+		vocals_stages	= [self.Stage_Key(2, [normalized_stage], model) for model in self.models['vocals']]
+		ensemble_stage	= self.Stage_Key(3, vocals_stages)
+		filters_stages	= [self.Stage_Key(4, [ensemble_stage], model) for model in self.models['filters']]
+		vocals_stage	= self.Stage_Key(5, [ensemble_stage] + filters_stages)
+		music_stage		= self.Stage_Key(6, [normalized_stage, vocals_stage] + instrum_stages)
+
+		# Stages to compute : from the FINALs back to the first ones
+
+		def Missing(key, stage, model_name = ""):
+			return stage is None or not self.Check_Already_Processed(key, model_name, stage, just_check=True)
+
+		def Compute(key, stage, needed, model_name = ""):
+			return Missing(key, stage, model_name) and (needed or self.Export_Missing(key, model_name, stage))
+
+		music_compute	 = Missing(6, music_stage)
+		vocals_compute	 = Missing(5, vocals_stage)
+		filters_compute	 = [Compute(4, stage, vocals_compute, model['Name']) for model, stage in zip(self.models['filters'], filters_stages)]
+		ensemble_compute = Compute(3, ensemble_stage, vocals_compute or any(filters_compute))
+		vocals_extract_compute  = [Compute(2, stage, ensemble_compute, model['Name']) for model, stage in zip(self.models['vocals'], vocals_stages)]
+		instrum_extract_compute = [Compute(1, stage, music_compute, model['Name']) for model, stage in zip(self.models['instrum'], instrum_stages)]
+
+		# A stage not computed is skipped if it's not in the stage cache, or if its file is already exported :
+		# it's NOT loaded, only recorded in the manifest (by "Missing()")
+		def Skipped(key, stage, compute, model_name = ""):
+			return not compute and (Missing(key, stage, model_name) or not self.Export_Missing(key, model_name, stage))
+
+		# Results of the stages got in this run : (key, model name) -> audio
+		results = {}
+
+		def Get(key, stage, Process, model_name = ""):
+			"""
+			Result of a stage : loaded from the stage cache, or processed (with the previous stages it needs)
+			"""
+			if (key, model_name) not in results:
+				audio = self.Check_Already_Processed(key, model_name, stage)
+				if audio is None:
+					audio = Process()
+					self.Save_Audio(key, audio, model_name, stage)
+				
+				# Stems kept for later ensembles
+				if key in [1, 2, 4]:  audio = self.Scratch_Keep(audio)
+
+				results[(key, model_name)] = audio
+			
+			return results[(key, model_name)]
+
+		def Forget(key):
+			for item in [item for item in results if item[0] == key]:  del results[item]
+			gc.collect()
 
-			if normalized is None:
+		def Normalized():
+			if not self.normalize:  return original_audio
+
+			def Process():
 				print("► Normalizing audio")
-				normalized = App.audio_utils.Normalize(original_audio)
+				return App.audio_utils.Normalize(original_audio, self.stream['stats'] if self.stream is not None else None)
+			
+			return Get(0, normalized_stage, Process)
 
-				self.Save_Audio(0, normalized)
-		else:
-			normalized = original_audio
-		
 		# print("► Processing vocals with MDX23C model")
 
 		# sources3 = demix_full_mdx23c(normalized, self.device, self.overlap_MDXv3)
@@ -404,157 +914,156 @@ class MusicSeparationModel:
 		#	self.Save_Audio("Vocal_MDX23C", vocals3)
 		
 		# Extract Music with MDX models
-		instrum_extract = []
-		for model in self.models['instrum']:
-			audio = self.Check_Already_Processed(1, model['Name'])
-			if audio is None:
-				audio = self.Extract_with_Model(EXTRACT_INSTRU, normalized, model)
+		def Instrum_Extract(model, stage):
+			def Process():
+				audio = self.Extract_with_Model(EXTRACT_INSTRU, Normalized(), model)
 				
 				# DON'T Apply silence filter !!
-				audio = audio * model['Compensation']    # Volume Compensation
-				
-				self.Save_Audio(1, audio, model['Name'])
+				return audio * model['Compensation']    # Volume Compensation
 			
-			instrum_extract.append(audio)
+			return Get(1, stage, Process, model['Name'])
 			
 		# TODO : Make Ensemble Music ???
 
 		# Extract Vocals with MDX models
-		vocals_extract = []
-		for model in self.models['vocals']:
-			audio = self.Check_Already_Processed(2, model['Name'])
-			if audio is None:
-				audio = self.Extract_with_Model(EXTRACT_VOCALS, normalized, model)
+		def Vocals_Extract(model, stage):
+			def Process():
+				audio = self.Extract_with_Model(EXTRACT_VOCALS, Normalized(), model)
 
 				audio = audio * model['Compensation']    # Volume Compensation
-				audio = App.audio_utils.Silent(audio, self.sample_rate)  # Apply silence filter
-
-				self.Save_Audio(2, audio, model['Name'])
+				return App.audio_utils.Silent(audio, self.sample_rate)  # Apply silence filter
 			
-			vocals_extract.append(audio)
+			return Get(2, stage, Process, model['Name'])
 		
 		# Make Ensemble Vocals
-		print("► Make Ensemble Vocals")
+		def Vocals_Ensemble():
+			def Process():
+				vocals_extract = [Vocals_Extract(model, stage) for model, stage in zip(self.models['vocals'], vocals_stages)]
 
-		vocals_ensemble = App.audio_utils.Make_Ensemble('Max Spec', vocals_extract)
+				print("► Make Ensemble Vocals")
 
-		# vocals_ensemble = App.utils.Silent(vocals_ensemble, self.sample_rate)  # Apply silence filter
-		
-		self.Save_Audio(3, vocals_ensemble)
-		
-		del vocals_extract;  gc.collect()
+				return App.audio_utils.Make_Ensemble('Max Spec', vocals_extract)
+
+				# vocals_ensemble = App.utils.Silent(vocals_ensemble, self.sample_rate)  # Apply silence filter
+			
+			return Get(3, ensemble_stage, Process)
 		
 		# Pass Vocals through Music Filters
-		if len(self.models['filters']) > 0:
-			
-			filters = []
-			for model in self.models['filters']:
-				audio = self.Check_Already_Processed(4, model['Name'])
-				if audio is None:
-					audio = self.Extract_with_Model(FILTER_AUDIO, vocals_ensemble, model)
+		def Filter(model, stage):
+			def Process():
+				vocals_ensemble = Vocals_Ensemble()
+				audio = self.Extract_with_Model(FILTER_AUDIO, vocals_ensemble, model)
 
-					audio = audio * model['Compensation']    # Volume Compensation
+				audio = audio * model['Compensation']    # Volume Compensation
 
-					# If model Stem is Vocals, substraction is needed !
-					if model['Stem'] != "Instrumental":  audio = vocals_ensemble - audio
+				# If model Stem is Vocals, substraction is needed !
+				if model['Stem'] != "Instrumental":  audio = vocals_ensemble - audio
 
-					audio = App.audio_utils.Silent(audio, self.sample_rate, -45)  # Apply silence filter : -45 dB !
+				return App.audio_utils.Silent(audio, self.sample_rate, -45)  # Apply silence filter : -45 dB !
+			
+			return Get(4, stage, Process, model['Name'])
 
-					self.Save_Audio(4, audio, model['Name'])
+		def Vocals_Final():
+			def Process():
+				vocals_ensemble = Vocals_Ensemble()
+				filters = [Filter(model, stage) for model, stage in zip(self.models['filters'], filters_stages)]
 				
-				filters.append(audio)
+				if len(filters) > 0:
+					# Make Ensemble Vocals
+					print("► Make Ensemble Filters")
 
-			# Make Ensemble Vocals
-			print("► Make Ensemble Filters")
+					filters_ensemble = App.audio_utils.Make_Ensemble('Max Spec', filters)
 
-			filters_ensemble = App.audio_utils.Make_Ensemble('Max Spec', filters)
+					#  Remove instrumental Bleedings (NOT in place : "vocals_ensemble" is kept in "results" for the other stages)
+					vocals_ensemble = vocals_ensemble - filters_ensemble
+				
+				# Save Vocals FINAL
+				print("► Save Vocals FINAL !")
 
-			#  Remove instrumental Bleedings
-			vocals_ensemble -= filters_ensemble
+				return App.audio_utils.Pass_filter('highpass', 85, vocals_ensemble, self.sample_rate)
 			
-			del filters;  gc.collect()
+			return Get(5, vocals_stage, Process)
 
-		# Save Vocals FINAL
-		print("► Save Vocals FINAL !")
+		def Music_Final():
+			def Process():
+				instrum_extract = [Instrum_Extract(model, stage) for model, stage in zip(self.models['instrum'], instrum_stages)]
 
-		vocals_ensemble = App.audio_utils.Pass_filter('highpass', 85, vocals_ensemble, self.sample_rate)
+				# Repair Music
+				print("► Get Music by substracting Vocals from Original audio")
+				instrum_final = Normalized() - Vocals_Final()
 
-		self.Save_Audio(5, vocals_ensemble)
-		
-		# Repair Music
-		print("► Get Music by substracting Vocals from Original audio")
-		instrum_final = normalized - vocals_ensemble
-
-		print("► Repair Instrumental with first Music Extractions")
-		for audio in instrum_extract:
-			audio = App.audio_utils.Pass_filter('highpass', 30, audio, self.sample_rate)
-			instrum_final = App.audio_utils.Make_Ensemble('Max Spec', [instrum_final, audio])
-		
-		del instrum_extract;  gc.collect()
+				print("► Repair Instrumental with first Music Extractions")
+				
+				# All extracts in 1 ensemble (same as chaining them) : only 1 iSTFT, and made by blocks
+				instrum_final = App.audio_utils.Make_Ensemble('Max Spec', [instrum_final] + \
+					[App.audio_utils.Pass_filter('highpass', 30, audio, self.sample_rate) for audio in instrum_extract])
+				
+				# Apply silence filter : -61 dB !
+				instrum_final = App.audio_utils.Silent(instrum_final, self.sample_rate, threshold_db = -61)
 
+				# Save Music FINAL
+				print("► Save Music FINAL !")
+				return instrum_final
+			
+			return Get(6, music_stage, Process)
 
-		# Apply silence filter : -61 dB !
-		instrum_final = App.audio_utils.Silent(instrum_final, self.sample_rate, threshold_db = -61)
+		# In the order of the recipe
+		if self.normalize and not Skipped(0, normalized_stage, Compute(0, normalized_stage, False)):  Normalized()
 
-		# Save Music FINAL
-		print("► Save Music FINAL !")
-		self.Save_Audio(6, instrum_final)
-		
-		#**********************************
-		#****  TESTING for DEVELOPERS  ****
-		#**********************************
+		# Extract Music & Vocals : independent extractions of the same input
+		tasks = [(EXTRACT_INSTRU, model) for model, compute in zip(self.models['instrum'], instrum_extract_compute) if compute] + \
+				[(EXTRACT_VOCALS, model) for model, compute in zip(self.models['vocals'],  vocals_extract_compute)  if compute]
 		
-		# The "song_output_path" contains the NAME of the song to compare within the "Multi-Song" folder
-		# That's all !!
-		if name.startswith("SDR_"):
+		if len(tasks) > 0:  self.Extract_in_Parallel(tasks, Normalized())
 
-			print("----------------------------------------")
-			App.compare.SDR(self.song_output_path, self.Options['Gdrive'])
-		
-			# And to Re-process immediately a file :
-			#os.remove(os.path.join(self.song_output_path, "2 - Vocal extract - (Kim Vocal 2).flac"))
-			
-			# OR all files :
-			#for file in os.listdir(self.song_output_path):
-			#	os.remove(os.path.join(self.song_output_path, file))
+		for model, stage, compute in zip(self.models['instrum'], instrum_stages, instrum_extract_compute):
+			if not Skipped(1, stage, compute, model['Name']):  Instrum_Extract(model, stage)
 
-		# TESTS - Examples (with old version of KaraFan 1.0)
-		
-		# instrum = instrum / self.model_instrum['Compensation']
-		# self.Save_Audio("Sub - 1", normalized - (instrum * 1.0235))
-		# self.Save_Audio("Sub - 2", normalized - (instrum * 1.0240))
-		# self.Save_Audio("Sub - 3", normalized - (instrum * 1.0245))
+		for model, stage, compute in zip(self.models['vocals'], vocals_stages, vocals_extract_compute):
+			if not Skipped(2, stage, compute, model['Name']):  Vocals_Extract(model, stage)
 
-		# vocals_final = vocals_final / self.model_vocals['Compensation']
-		# instrum_final_1 = normalized - (vocals_final * 1.0082)
-		# instrum_final_2 = normalized - (vocals_final * 1.0085)
-		# instrum_final_3 = normalized - (vocals_final * 1.0088)
-		# self.Save_Audio("Music - Test 1", instrum_final_1)
-		# self.Save_Audio("Music - Test 2", instrum_final_2)
-		# self.Save_Audio("Music - Test 3", instrum_final_3)
+		if not Skipped(3, ensemble_stage, ensemble_compute):  Vocals_Ensemble()
+		Forget(2)
+
+		for model, stage, compute in zip(self.models['filters'], filters_stages, filters_compute):
+			if not Skipped(4, stage, compute, model['Name']):  Filter(model, stage)
+
+		# No more MDX models for this song
+		if self.spec_cache is not None:
+			if self.DEBUG:  print(f"Spectrograms cache : {self.spec_cache.hits} hits, {self.spec_cache.misses} misses")
+			self.spec_cache.clear()
+		self.resample_cache.clear()
+
+		if not Skipped(5, vocals_stage, vocals_compute):  Vocals_Final()
+		Forget(3);  Forget(4)
+
+		if not Skipped(6, music_stage, music_compute):  Music_Final()
+		results.clear();  gc.collect()
 
+		self.extracted.clear()  # Not picked up (e.g. if a stage was removed from the stage cache during this run)
 
 	def Update_Status(self):
 		self.Status.value = self.Led_Red if self.Status_ON else self.Led_Yellow
 		self.Status_ON = not self.Status_ON
 
 	def Load_MDX(self, model):
-		name = model['Name']
-		if name not in self.MDX:
-			self.MDX[name] = {}
-			self.MDX[name]['model'] = get_models(self.device, model, model['Stem'])
-			self.MDX[name]['inference'] = ort.InferenceSession(
-				model['PATH'],
-				providers = self.providers,
-				provider_options = [{"device_id": 0}]
-			)
-	
-	def Kill_MDX(self, model_name):
-		if model_name in self.MDX:
-			del self.MDX[model_name]['inference']
-			del self.MDX[model_name]['model']
-			del self.MDX[model_name]
-			gc.collect()
+		"""
+		Get a model from the pool : loaded only if it's not already in memory
+		"""
+		return self.MDX.Get(model['Name'], lambda: self.Create_MDX(model), os.path.getsize(model['PATH']))
+
+	def Create_MDX(self, model):
+		print(f'Loading model "{model["Name"]}" ...')
+
+		mdx = {}
+		mdx['model'] = get_models(self.device, model, model['Stem'], self.stft_backend)
+		
+		path = None
+		if self.onnx_stft:
+			path = App.onnx_utils.Wrap_STFT_Model(model)  # None on error -> original model
+		
+		mdx['inference'] = App.onnx_utils.Create_Session(path or model['PATH'], self.providers, self.Options)
+		return mdx
 
 	def raise_aicrowd_error(self, msg):
 		# Will be used by the evaluator to provide logs, DO NOT CHANGE
@@ -565,83 +1074,155 @@ class MusicSeparationModel:
 
 		name = os.path.splitext(name)[0]
 		
-		with self.CONSOLE:
-			audio_mp3 = io.BytesIO()
-			audio_mp3.name = "Preview.mp3"
-			
-			# Get the first 60 seconds of the audio
-			audio = audio[:, :int(60.3 * self.sample_rate)]
+		# Encoded in background, and added to the console when ready
+		if self.writer is not None:
+			self.writer.Submit("Preview : " + name, Encode_Preview, name, audio, self.sample_rate, self.CONSOLE)
+		else:
+			with self.CONSOLE:
+				display(HTML(Encode_Preview(name, audio, self.sample_rate)))
 
-			# Convert audio to PCM_16 audio data (bytes)
-			audio_tmp = (audio.T * 32768).astype(np.int16)  # 2 ^15
+	def Stage_Source(self, audio):
+		"""
+		Identity of the input audio of the song (None if the stage cache is disabled)
+		"""
+		return App.cache.Audio_Key(audio) if self.stages is not None else None
 
-			audio_segment = AudioSegment(
-				audio_tmp.tobytes(),
-				channels = 2,
-				frame_rate = self.sample_rate,
-				sample_width = 2  # sample width (in bytes)
-			)
+	def Stage_Key(self, key, inputs, model = None):
+		"""
+		Fingerprint of the result of a stage in the stage cache :
+		the fingerprints of its inputs (or the identity of the song : see "Stage_Source()"), the model & the options that change this result.
+		Options that only change the way it's computed (batch size, STFT backend, ...) are NOT in the key.
+		Returns : None if the stage cache is disabled
+		"""
+		if None in inputs:  return None
+
+		options = [STAGES_VERSION, key, inputs, self.sample_rate, self.TEST_MODE]
 
-			# audio_segment.export(audio_mp3, format='mp3', bitrate='192k', codec='libmp3lame')
-			audio_segment.export(audio_mp3, format='mp3', bitrate='192k', codec='libshine')
-			# audio_mp3.seek(0)
+		# Streaming mode : normalized with the peak of the WHOLE song
+		if key == 0 and self.stream is not None:  options.append(self.stream['stats'])
 
-			display(HTML(
-				'<div class="player"><div>'+ name +'</div><audio controls preload="metadata" src="data:audio/mp3;base64,' \
-				+ base64.b64encode(audio_mp3.getvalue()).decode('utf-8') +'"></audio></div>'))
+		if model is not None:
+			shifts = {1: self.shifts_instru, 2: self.shifts_vocals, 4: self.shifts_filter}[key]
+			options += [model[name] for name in ['Name', 'Stem', 'Compensation', 'Cut_OFF', 'N_FFT_scale', 'dim_F_set', 'dim_T_set']]
+			options += [shifts, self.overlap_MDX, self.chunk_size, self.paired_polarity, self.srs_spectral]
 
-			# audio_mp3.close()
+		return hashlib.blake2b(repr(options).encode(), digest_size=16).hexdigest()
 
-	def Check_Already_Processed(self, key, model_name = "", just_check = False):
+	def Check_Already_Processed(self, key, model_name = "", stage = None, just_check = False):
 		"""
-		if GOD MODE :
-			- Check if audio file is already processed, and if so, load it.
-			- Return AUDIO loaded, or NONE if not found.
-		Else :
-			- Return NONE.
+		- Check if this stage was already processed with the same input & options (see "Stage_Key()"),
+		  and if so, load it from the stage cache.
+		- Return AUDIO loaded, or NONE if not found.
 		Key :
-			index of AudioFiles list or "str" (direct filename for test mode)
+			index of AudioFiles list
 		"""
 		self.Update_Status()
 		
-		if type(key) is int:
-			filename = self.AudioFiles[key]
-			if self.DEBUG:  filename = f"{key} - {filename}"
-		else:
-			filename = key
+		if stage is None:  return None
 
-		if model_name != "":  filename += " - ("+ model_name +")"
+		self.Record_Stage(key, model_name, stage)
 
-		match self.Options['output_format']:
-			case 'PCM_16':	filename += '.wav'
-			case 'FLOAT':	filename += '.wav'
-			case "FLAC":	filename += '.flac'
-			case 'MP3':		filename += '.mp3'
+		if just_check:  return stage in self.stages
 
-		file = os.path.join(self.song_output_path, filename)
-		
-		if (self.GOD_MODE or (type(key) is int and key in self.AudioFiles_Mandatory)) and os.path.isfile(file):
-			
-			if just_check:  return True
-			
-			print(filename + " --> Loading ...")
-			audio, _ = librosa.load(file, mono=False, sr=self.sample_rate)
-			
-			# Preview Audio file
-			if self.PREVIEWS and self.CONSOLE:  self.Show_Preview(filename, audio)
+		audio = self.stages.get(stage)
+		if audio is None:  return None
+
+		filename = self.Audio_Filename(key, model_name)
+		print(filename + " --> Loading ...")
 
-			return audio
+		# The exported file is written again if it was deleted, or if it's written block by block
+		if self.stream is not None or not os.path.isfile(os.path.join(self.song_output_path, filename)):
+			self.Save_Audio(key, audio, model_name)
 		
-		return None
+		# Preview Audio file
+		elif self.PREVIEWS and self.CONSOLE:  self.Show_Preview(filename, audio)
+
+		return audio
 	
-	def Save_Audio(self, key, audio, model_name = ""):
+	def Export_Missing(self, key, model_name, stage):
+		"""
+		True if the exported file of this stage must be written : missing, made with other options (see "Update_Manifest()"),
+		or written block by block
+		"""
+		if not self.DEBUG and key not in self.AudioFiles_Mandatory:  return False
+		if self.stream is not None:  return True
+
+		filename = self.Audio_Filename(key, model_name)
+		item = self.exported.get(filename)
+
+		return item is None or stage not in item['stages'] or not os.path.isfile(os.path.join(self.song_output_path, filename))
+
+	def Record_Stage(self, key, model_name, stage):
+		"""
+		Add a stage of this song to its manifest, with its exported file (if any)
+		"""
+		if self.manifest is None:  return
+
+		file = self.Audio_Filename(key, model_name) if self.DEBUG or key in self.AudioFiles_Mandatory else ""
+		label = file or self.Audio_Filename(key, model_name).rsplit('.', 1)[0]
+
+		item = self.manifest.setdefault(label, {'index': key, 'stages': [], 'file': file})
+		if stage not in item['stages']:  item['stages'].append(stage)  # Streaming mode : 1 stage for each block
+
+	def Update_Manifest(self):
+		"""
+		Delete the exported files of stages made with other inputs or options (in a previous run),
+		and save the manifest of this song
+		"""
+		if self.manifest is None:  return
+
+		stages = {stage for item in self.manifest.values() for stage in item['stages']}
+
+		for label, item in self.exported.items():
+			if label in self.manifest:  continue
+
+			# Still the same results (e.g. exported with another name)
+			if set(item['stages']) <= stages:
+				self.manifest[label] = item;  continue
+			
+			if item['file'] != "":
+				try:
+					os.remove(os.path.join(self.song_output_path, item['file']))
+					print(item['file'] + " --> Deleted : made with other options")
+				except OSError:
+					pass
+
+		App.cache.Save_Manifest(self.song_output_path, self.manifest)
+		self.manifest = None;  self.exported = {}
+
+	def Save_Audio(self, key, audio, model_name = "", stage = None):
 		"""
 		Key : index of AudioFiles list or "str" (direct filename for test mode)
+		"stage" : key of this result in the stage cache (see "Stage_Key()"), saved even if the file is not exported
 		"""
-		
+		if stage is not None:
+			if self.writer is not None:
+				self.writer.Submit("Stage cache : " + self.Audio_Filename(key, model_name), self.stages.put, stage, audio)
+			else:
+				self.stages.put(stage, audio)
+
 		# Save only mandatory files if not in DEBUG mode
 		if not self.DEBUG and type(key) is int and key not in self.AudioFiles_Mandatory:  return
 
+		filename = self.Audio_Filename(key, model_name)
+		file = os.path.join(self.song_output_path, filename)
+		
+		if self.stream is not None:
+			self.Stream_Audio(filename, file, audio, self.Output_Format());  return
+
+		# Written in background (from a copy of the array)
+		if self.writer is not None:
+			self.writer.Submit(filename, Write_Audio, file, audio, self.sample_rate, self.Options['output_format'])
+		else:
+			Write_Audio(file, audio, self.sample_rate, self.Options['output_format'])
+		
+		# Preview Audio file
+		if self.PREVIEWS and self.CONSOLE:  self.Show_Preview(filename, audio)
+
+	def Audio_Filename(self, key, model_name = ""):
+		"""
+		Key : index of AudioFiles list or "str" (direct filename for test mode)
+		"""
 		if type(key) is int:
 			filename = self.AudioFiles[key]
 			if self.DEBUG:  filename = f"{key} - {filename}"
@@ -650,47 +1231,44 @@ class MusicSeparationModel:
 
 		if model_name != "":  filename += " - ("+ model_name +")"
 
-		match self.Options['output_format']:
+		match self.Output_Format():
 			case 'PCM_16':	filename += '.wav'
 			case 'FLOAT':	filename += '.wav'
 			case "FLAC":	filename += '.flac'
 			case 'MP3':		filename += '.mp3'
 
-		file = os.path.join(self.song_output_path, filename)
-		
-		# Save as WAV
-		match self.Options['output_format']:
-			case 'PCM_16':
-				sf.write(file, audio.T, self.sample_rate, subtype='PCM_16')
-			case 'FLOAT':
-				sf.write(file, audio.T, self.sample_rate, subtype='FLOAT')
-			case "FLAC":
-				sf.write(file, audio.T, self.sample_rate, format='flac', subtype='PCM_24')
-			case 'MP3':
-				# Convert audio to PCM_16 audio data (bytes)
-				audio_tmp = (audio.T * 32768).astype(np.int16)  # 2 ^15
-
-				audio_segment = AudioSegment(
-					audio_tmp.tobytes(),
-					channels = 2,
-					frame_rate = self.sample_rate,
-					sample_width = 2  # sample width (in bytes)
-				)
-
-				# about VBR/CBR/ABR		: https://trac.ffmpeg.org/wiki/Encode/MP3
-				# about ffmpeg wrapper	: http://ffmpeg.org/ffmpeg-codecs.html#libmp3lame-1
-				# recommended settings	: https://wiki.hydrogenaud.io/index.php?title=LAME#Recommended_encoder_settings
-
-				# 320k is mandatory, else there is a weird cutoff @ 16khz with VBR parameters = ['-q','0'] !!
-				# (equivalent to lame "-V0" - 220-260 kbps , 245 kbps average)
-				# And also, parameters = ['-joint_stereo', '0'] (Separated stereo channels)
-				# is WORSE than "Joint Stereo" for High Frequencies !
-				# So let's use it by default for MP3 encoding !!
-
-				audio_segment.export(file, format='mp3', bitrate='320k', codec='libmp3lame')
+		return filename
+
+	def Output_Format(self):
 		
-		# Preview Audio file
-		if self.PREVIEWS and self.CONSOLE:  self.Show_Preview(filename, audio)
+		output_format = self.Options['output_format']
+
+		# Streaming mode : MP3 can't be written block by block
+		if self.stream is not None and output_format == 'MP3':  output_format = "FLAC"
+
+		return output_format
+
+	def Stream_Audio(self, filename, file, audio, output_format):
+		"""
+		Append the current block to "file" (created with the 1st block)
+		"""
+		start, length = self.stream['crop']
+		audio = audio[:, start:(start + length)]
+
+		sound = self.stream['files'].get(file)
+		if sound is None:
+			match output_format:
+				case 'PCM_16':	format = 'WAV';   subtype = 'PCM_16'
+				case 'FLOAT':	format = 'WAV';   subtype = 'FLOAT'
+				case "FLAC":	format = 'FLAC';  subtype = 'PCM_24'
+
+			sound = sf.SoundFile(file, 'w', self.sample_rate, audio.shape[0], subtype, format=format)
+			self.stream['files'][file] = sound
+
+		if self.stream['writer'] is not None:
+			self.stream['writer'].Submit(filename, sound.write, audio.T)
+		else:
+			sound.write(audio.T)
 
 	def Match_Freq_CutOFF(self, audio1, audio2, sample_rate):
 		# This option matches the Primary stem frequency cut-off to the Secondary stem frequency cut-off
@@ -728,23 +1306,30 @@ class MusicSeparationModel:
 		elif type == FILTER_AUDIO:	
 			bigshifts = self.shifts_filter;  text = f'► Filter Vocals with "{name}"'
 		
-		if not self.large_gpu:
-			print(f'Large GPU is disabled : Loading model "{name}" now...')
-			self.Load_MDX(model)
-		
-		mdx_model = self.MDX[name]['model']
-		inference = self.MDX[name]['inference']
+		# Already done by a worker process (see "Extract_in_Parallel()")
+		if (type, name) in self.extracted:
+			return self.extracted.pop((type, name))
+
+		mdx = self.Load_MDX(model)
+		mdx_model = mdx['model']
+		inference = mdx['inference']
+
+		cache = self.spec_cache if self.Spec_Shared(type, model) else None
 
 		# ONLY 1 Pass, for testing purposes
 		if self.TEST_MODE:
 			print(text)
-			source = self.demix_full(audio, mdx_model, inference, bigshifts)[0]
+			source = self.demix_full(audio, mdx_model, inference, bigshifts, cache = cache)[0]
+		
+		elif self.paired_polarity:
+			print(text +" (Pass 1 & 2)")
+			source = self.demix_full(audio, mdx_model, inference, bigshifts, PAIRED_POLARITY, cache = cache)[0]
 		else:
 			print(text +" (Pass 1)")
-			source = 0.5 * -self.demix_full(-audio, mdx_model, inference, bigshifts)[0]
+			source = 0.5 * self.demix_full(audio, mdx_model, inference, bigshifts, -1, cache = cache)[0]
 
 			print(text +" (Pass 2)")
-			source += 0.5 * self.demix_full(audio, mdx_model, inference, bigshifts)[0]
+			source += 0.5 * self.demix_full(audio, mdx_model, inference, bigshifts, cache = cache)[0]
 
 		# Automatic SRS
 		if model['Cut_OFF'] > 0:
@@ -754,19 +1339,35 @@ class MusicSeparationModel:
 
 			pitch = 6 if model['Cut_OFF'] < 17000 else 5
 
+			# Experimental : stretched spectrograms of the original audio, instead of resampling
+			# (not possible with STFT inside the ONNX graph)
+			srs = None
+			if self.srs_spectral and inference.get_inputs()[0].name != 'waveform':
+				srs = pitch / 4;  text += " -> Spectral"
+				audio_SRS = audio
+			else:
+				audio_SRS = self.Resample_SRS(audio, pitch, 4)
+
 			# ONLY 1 Pass, for testing purposes
 			if self.TEST_MODE:
 				print(text + " -> SRS")
-				source_SRS = App.audio_utils.Change_sample_rate( self.demix_full(
-					App.audio_utils.Change_sample_rate( audio, pitch, 4), mdx_model, inference, bigshifts)[0], 4, pitch)
+				source_SRS = self.demix_full(audio_SRS, mdx_model, inference, bigshifts, 1, srs, cache = cache)[0]
+			
+			elif self.paired_polarity:
+				print(text +" -> SRS (Pass 1 & 2)")
+				source_SRS = self.demix_full(audio_SRS, mdx_model, inference, bigshifts, PAIRED_POLARITY, srs, cache = cache)[0]
 			else:
 				print(text +" -> SRS (Pass 1)")
-				source_SRS = 0.5 * App.audio_utils.Change_sample_rate( -self.demix_full(
-					App.audio_utils.Change_sample_rate( -audio, pitch, 4), mdx_model, inference, bigshifts)[0], 4, pitch)
+				source_SRS = 0.5 * self.demix_full(audio_SRS, mdx_model, inference, bigshifts, -1, srs, cache = cache)[0]
 
 				print(text +" -> SRS (Pass 2)")
-				source_SRS += 0.5 * App.audio_utils.Change_sample_rate( self.demix_full(
-					App.audio_utils.Change_sample_rate( audio, pitch, 4), mdx_model, inference, bigshifts)[0], 4, pitch)
+				source_SRS += 0.5 * self.demix_full(audio_SRS, mdx_model, inference, bigshifts, 1, srs, cache = cache)[0]
+
+			del audio_SRS
+
+			# Resampled directly to the shape of "source" (cut or padded with zeros)
+			if srs is None:
+				source_SRS = App.audio_utils.Change_sample_rate(source_SRS, 4, pitch, out = np.empty(source.shape, dtype=np.float32))
 
 			# old formula :  vocals = Linkwitz_Riley_filter(vocals.T, 12000, 'lowpass') + Linkwitz_Riley_filter((3 * vocals_SRS.T) / 4, 12000, 'highpass')
 			# *3/4 = Dynamic SRS personal taste of "Jarredou", to avoid too much SRS noise
@@ -774,14 +1375,7 @@ class MusicSeparationModel:
 
 			cutoff = model['Cut_OFF'] - 2700
 
-			# Check if source_SRS is not longer than source
-			source_SRS = App.audio_utils.match_array_shapes(source_SRS, source)
-
-			source = App.audio_utils.Linkwitz_Riley_filter(source, cutoff, 'lowpass', self.sample_rate, order = 4) \
-				   + App.audio_utils.Linkwitz_Riley_filter(source_SRS, cutoff, 'highpass', self.sample_rate, order = 4)
-			source = source.T
-
-		if not self.large_gpu:  self.Kill_MDX(name)
+			source = App.audio_utils.Crossover(cutoff, self.sample_rate, order = 4).Merge(source, source_SRS)
 
 		# TODO : Implement band Pass filter
 		#
@@ -809,64 +1403,348 @@ class MusicSeparationModel:
 
 		return source
 	
-	def demix_full(self, mix, use_model, infer_session, bigshifts):
+	def Extract_in_Parallel(self, tasks, audio):
+		"""
+		Run independent extractions of the same "audio" in worker processes,
+		results are then picked up by "Extract_with_Model()" in the original order.
+		tasks : list of (type, model)
+		"""
+		if self.parallel_workers < 1 or len(tasks) < 2:  return
+
+		for type, model in tasks:
+			text = "Music" if type == EXTRACT_INSTRU else "Vocals"
+			print(f'► Extract {text} with "{model["Name"]}" (in parallel)')
+
+		try:
+			with App.parallel.Extract_Pool(self.Options, min(self.parallel_workers, len(tasks))) as pool:
+				results = pool.Extract(tasks, audio, self.sample_rate, self.Progress)
+		except Exception as e:
+			print("\n\nError in a worker process : ", e)
+			Exit_Notebook()
+
+		for (type, model), result in zip(tasks, results):
+			self.extracted[(type, model['Name'])] = result
+
+	def Resample_SRS(self, audio, up, down):
+		"""
+		Resampled once per song for all models & passes :
+		the inverted polarity is applied later by "demix_base()", no need to resample "-audio" !
+		"""
+		key = (App.cache.Audio_Key(audio), up, down)
+		audio_SRS = self.resample_cache.get(key)
+
+		if audio_SRS is None:
+			audio_SRS = App.audio_utils.Change_sample_rate(audio, up, down)
+			audio_SRS.flags.writeable = False  # Shared !
+			self.resample_cache.put(key, audio_SRS)
+
+		return audio_SRS
+
+	def Spec_Shared(self, type, model):
+		"""
+		Spectrograms of the input are cached only if they can be used again :
+		by another model with the same FFT geometry, or by the other polarity pass.
+		Else, they would only take the room of the useful ones (see "LRU_Cache")
+		"""
+		if self.spec_cache is None:  return False
+		if not self.paired_polarity and not self.TEST_MODE:  return True
+
+		models = self.models['filters'] if type == FILTER_AUDIO else self.models['instrum'] + self.models['vocals']
+		geometry = lambda row: (row['N_FFT_scale'], row['dim_F_set'], row['dim_T_set'])
+
+		return sum(geometry(row) == geometry(model) for row in models) > 1
+
+	def demix_full(self, mix, use_model, infer_session, bigshifts, polarity = 1, srs = None, cache = None):
 		
-		step = int(self.chunk_size)
 		mix_length = mix.shape[1] / 44100
 
 		if bigshifts < 1:  bigshifts = 1  # must not be <= 0 !
 		if bigshifts > int(mix_length):  bigshifts = int(mix_length - 1)
-		results = []
 		shifts  = [x for x in range(bigshifts)]
 		
-		# Kept in case of Colab policy change for using GUI
-		# and we need back to old "stdout" redirection
-		#
-		# with self.CONSOLE if self.CONSOLE else stdout_redirect_tqdm() as output:
-			# dynamic_ncols is mandatory for stdout_redirect_tqdm()
-			# for shift in tqdm(shifts, file=output, ncols=40, unit="Big shift", mininterval=1.0, dynamic_ncols=True):
-
-		# with self.CONSOLE if self.CONSOLE else stdout_redirect_tqdm() as output:
+		# Identity of the mix for the spectrograms cache
+		mix_key = App.cache.Audio_Key(mix) if cache is not None else None
+
+		# Buffers of this call are deleted when it returns : only the result is kept
+		with self.Scratch_Temporary():
+			if self.batch_shifts:
+				return self.demix_shifts(mix, use_model, infer_session, shifts, polarity, mix_key, srs, cache)
+
+			# Kept in case of Colab policy change for using GUI
+			# and we need back to old "stdout" redirection
+			#
+			# with self.CONSOLE if self.CONSOLE else stdout_redirect_tqdm() as output:
+				# dynamic_ncols is mandatory for stdout_redirect_tqdm()
+				# for shift in tqdm(shifts, file=output, ncols=40, unit="Big shift", mininterval=1.0, dynamic_ncols=True):
+
+			# with self.CONSOLE if self.CONSOLE else stdout_redirect_tqdm() as output:
 		
-		self.Progress.reset(len(shifts), unit="Big shift")
+			self.Progress.reset(len(shifts), unit="Big shift")
+
+			# Same chunks for ALL shifts
+			chunks, divider = self.Get_Chunks(mix.shape[1])
+
+			results = self.Scratch_Zeros((len(shifts), 1, 2, mix.shape[1]))
 
-		for shift in shifts:
+			for index, shift in enumerate(shifts):
 			
-			self.Update_Status()
+				self.Update_Status()
 
-			shift_samples = int(shift * 44100)
-			# print(f"shift_samples = {shift_samples}")
+				shift_samples = int(shift * 44100)
+				# print(f"shift_samples = {shift_samples}")
+			
+				shifted_mix = np.concatenate((mix[:, -shift_samples:], mix[:, :-shift_samples]), axis=-1)
+				# print(f"shifted_mix shape = {shifted_mix.shape}")
+				result = self.Scratch_Zeros((1, 2, shifted_mix.shape[-1]))
+
+				for start, end in chunks:
+					mix_part = shifted_mix[:, start:end]
+					# print(f"mix_part shape = {mix_part.shape}")
+					keys = [(mix_key, shift_samples, start, end)] if mix_key else None
+					sources = demix_base([mix_part], self.device, use_model, infer_session, self.batch_size, polarity, cache, keys, srs)[0]
+					if divider is not None:
+						sources *= self.Chunk_Window(start, end, mix.shape[1]) / divider[start:end]
+				
+					result[..., start:end] += sources
+					# print(f"result shape = {result.shape}")
 			
-			shifted_mix = np.concatenate((mix[:, -shift_samples:], mix[:, :-shift_samples]), axis=-1)
-			# print(f"shifted_mix shape = {shifted_mix.shape}")
-			result = np.zeros((1, 2, shifted_mix.shape[-1]), dtype=np.float32)
-			divider = np.zeros((1, 2, shifted_mix.shape[-1]), dtype=np.float32)
-
-			total = 0
-			for i in range(0, shifted_mix.shape[-1], step):
-				total += 1
-
-				start = i
-				end = min(i + self.chunk_size, shifted_mix.shape[-1])
-				mix_part = shifted_mix[:, start:end]
-				# print(f"mix_part shape = {mix_part.shape}")
-				sources = demix_base(mix_part, self.device, use_model, infer_session)
-				result[..., start:end] += sources
 				# print(f"result shape = {result.shape}")
-				divider[..., start:end] += 1
+				results[index] = np.concatenate((result[..., shift_samples:], result[..., :shift_samples]), axis=-1)
+				if self.scratch is not None:  self.scratch.Free(result)
+				del result
+
+				self.Progress.update()
 			
-			result /= divider
-			# print(f"result shape = {result.shape}")
-			result = np.concatenate((result[..., shift_samples:], result[..., :shift_samples]), axis=-1)
-			results.append(result)
+			results = np.mean(results, axis=0)
+			return results
+	
+	def demix_shifts(self, mix, use_model, infer_session, shifts, polarity = 1, mix_key = None, srs = None, cache = None):
+		"""
+		Same result as "demix_full()", but ALL BigShifts are processed together :
+		the rolled mixes of each chunk share the same ONNX batches (STFT, inference & iSTFT),
+		then they are un-rolled and averaged in a single accumulator.
+		"""
+		length = mix.shape[1]
+		shift_samples = [int(shift * 44100) for shift in shifts]
+
+		# Rolled mixes are only views on the mix repeated twice : no copy for each shift !
+		mix_2  = self.Scratch_Zeros((mix.shape[0], 2 * length), mix.dtype)
+		mix_2[:, :length] = mix;  mix_2[:, length:] = mix
+		
+		result = self.Scratch_Zeros((1, 2, length))
+
+		chunks, divider = self.Get_Chunks(length)
+		self.Progress.reset(len(chunks), unit="Chunk")
+
+		for start, end in chunks:
+
+			self.Update_Status()
+
+			mix_parts = [mix_2[:, length - k + start : length - k + end] for k in shift_samples]
+
+			keys = [(mix_key, k, start, end) for k in shift_samples] if mix_key else None
+			sources = demix_base(mix_parts, self.device, use_model, infer_session, self.batch_size, polarity, cache, keys, srs)[0]
+			if divider is not None:
+				sources *= self.Chunk_Window(start, end, length) / divider[start:end]
+
+			# Un-roll : position "p" in a mix rolled by "k" samples is "p - k" in the original mix
+			for source, k in zip(sources, shift_samples):
+				first = start - k;  last = end - k
+				if first >= 0:
+					result[..., first:last] += source
+				elif last <= 0:
+					result[..., length + first : length + last] += source
+				else:
+					result[..., length + first:] += source[:, :-first]
+					result[..., :last] += source[:, -first:]
 
 			self.Progress.update()
-			
-		results = np.mean(results, axis=0)
-		return results
+
+		result /= len(shifts)
+		return result
+	
+	def Get_Chunks(self, length):
+		"""
+		Split the audio in chunks of "chunk_size", overlapping by "overlap_MDX".
+		Returns : list of (start, end) and the sum of all crossfade windows (None if no overlap)
+		The divider is the same for all BigShifts : it's computed only once.
+		"""
+		step = max(1, int(self.chunk_size * (1 - self.overlap_MDX)))
+
+		chunks = []
+		for start in range(0, length, step):
+			end = min(start + self.chunk_size, length)
+			chunks.append((start, end))
+			if end == length:  break
+		
+		# Chunks are just side by side
+		if step >= self.chunk_size:  return chunks, None
+
+		divider = self.Scratch_Zeros(length)
+		for start, end in chunks:
+			divider[start:end] += self.Chunk_Window(start, end, length)
+
+		return chunks, divider
+
+	def Scratch_Zeros(self, shape, dtype = np.float32):
+		"""
+		Big array filled with zeros : memory-mapped if a scratch folder is set
+		"""
+		return self.scratch.Zeros(shape, dtype) if self.scratch is not None else np.zeros(shape, dtype=dtype)
+
+	def Scratch_Temporary(self):
+		"""
+		Block where the memory-mapped arrays of "Scratch_Zeros()" are temporary (see "Scratch.Temporary()")
+		"""
+		return self.scratch.Temporary() if self.scratch is not None else contextlib.nullcontext()
+
+	def Scratch_Keep(self, audio):
+		"""
+		Stem kept for later ensembles : moved to a memory-mapped file if a scratch folder is set
+		"""
+		return self.scratch.Keep(audio) if self.scratch is not None else audio
+
+	def Chunk_Window(self, start, end, length):
+		"""
+		Crossfade window of a chunk : linear fade-in & fade-out on the overlapping parts,
+		except at the beginning and the end of the audio
+		"""
+		fade = self.chunk_size - max(1, int(self.chunk_size * (1 - self.overlap_MDX)))
+		fade = min(fade, end - start)
+		
+		window = np.ones(end - start, dtype=np.float32)
+		if fade > 0:
+			ramp = (np.arange(fade, dtype=np.float32) + 0.5) / fade
+			if start > 0:		window[:fade]  *= ramp
+			if end < length:	window[-fade:] *= ramp[::-1]
+
+		return window
 	
 	#----
 
+def Write_Audio(file, audio, sample_rate, output_format):
+	"""
+	Encode & write an audio file (see "Save_Audio()")
+	"""
+	# Save as WAV
+	match output_format:
+		case 'PCM_16':
+			sf.write(file, audio.T, sample_rate, subtype='PCM_16')
+		case 'FLOAT':
+			sf.write(file, audio.T, sample_rate, subtype='FLOAT')
+		case "FLAC":
+			sf.write(file, audio.T, sample_rate, format='flac', subtype='PCM_24')
+		case 'MP3':
+			# Convert audio to PCM_16 audio data (bytes)
+			audio_tmp = (audio.T * 32768).astype(np.int16)  # 2 ^15
+
+			audio_segment = AudioSegment(
+				audio_tmp.tobytes(),
+				channels = 2,
+				frame_rate = sample_rate,
+				sample_width = 2  # sample width (in bytes)
+			)
+
+			# about VBR/CBR/ABR		: https://trac.ffmpeg.org/wiki/Encode/MP3
+			# about ffmpeg wrapper	: http://ffmpeg.org/ffmpeg-codecs.html#libmp3lame-1
+			# recommended settings	: https://wiki.hydrogenaud.io/index.php?title=LAME#Recommended_encoder_settings
+
+			# 320k is mandatory, else there is a weird cutoff @ 16khz with VBR parameters = ['-q','0'] !!
+			# (equivalent to lame "-V0" - 220-260 kbps , 245 kbps average)
+			# And also, parameters = ['-joint_stereo', '0'] (Separated stereo channels)
+			# is WORSE than "Joint Stereo" for High Frequencies !
+			# So let's use it by default for MP3 encoding !!
+
+			audio_segment.export(file, format='mp3', bitrate='320k', codec='libmp3lame')
+
+def Encode_Preview(name, audio, sample_rate, CONSOLE = None):
+	"""
+	MP3 player of the first 60 seconds (HTML) : added to "CONSOLE" if given (from a background thread)
+	"""
+	audio_mp3 = io.BytesIO()
+	audio_mp3.name = "Preview.mp3"
+	
+	# Get the first 60 seconds of the audio
+	audio = audio[:, :int(60.3 * sample_rate)]
+
+	# Convert audio to PCM_16 audio data (bytes)
+	audio_tmp = (audio.T * 32768).astype(np.int16)  # 2 ^15
+
+	audio_segment = AudioSegment(
+		audio_tmp.tobytes(),
+		channels = 2,
+		frame_rate = sample_rate,
+		sample_width = 2  # sample width (in bytes)
+	)
+
+	# audio_segment.export(audio_mp3, format='mp3', bitrate='192k', codec='libmp3lame')
+	audio_segment.export(audio_mp3, format='mp3', bitrate='192k', codec='libshine')
+	# audio_mp3.seek(0)
+
+	html = '<div class="player"><div>'+ name +'</div><audio controls preload="metadata" src="data:audio/mp3;base64,' \
+		+ base64.b64encode(audio_mp3.getvalue()).decode('utf-8') +'"></audio></div>'
+
+	# audio_mp3.close()
+
+	# Thread-safe way to display in an "Output" widget
+	if CONSOLE is not None:  CONSOLE.append_display_data(HTML(html))
+	
+	return html
+
+def Stream_Duration(file):
+	"""
+	Duration in seconds, read from the header only (0 if "soundfile" can't read this format)
+	"""
+	try:
+		info = sf.info(file)
+		return info.frames / info.samplerate
+	except Exception:
+		return 0
+
+def Stream_Blocks(file, block_seconds, margin_seconds = STREAM_MARGIN):
+	"""
+	Decode a song block by block, resampled to 44.1 Khz like "Load_Audio()".
+	Each block has "margin_seconds" more audio on each side (when available), to avoid artifacts at the junctions.
+	Returns : (audio, start, length) -> the block itself is audio[:, start : start + length]
+	"""
+	with sf.SoundFile(file) as sound:
+		sample_rate = sound.samplerate;  frames = sound.frames
+
+		block  = int(block_seconds  * sample_rate)
+		margin = int(margin_seconds * sample_rate)
+		total  = int(np.ceil(frames * 44100 / sample_rate))  # Same length as "librosa.load()"
+
+		for position in range(0, frames, block):
+			begin = max(0, position - margin)
+			sound.seek(begin)
+			audio = sound.read(min(frames, position + block + margin) - begin, dtype='float32', always_2d=True).T
+
+			# Convert mono to stereo (if needed)
+			if audio.shape[0] == 1:
+				audio = np.concatenate([audio, audio], axis=0)
+
+			if sample_rate != 44100:
+				audio = librosa.resample(audio, orig_sr=sample_rate, target_sr=44100)
+
+			start  = (position - begin) * 44100 // sample_rate
+			offset = position * 44100 // sample_rate
+			length = min(block * 44100 // sample_rate, total - offset, audio.shape[1] - start)
+
+			yield audio, start, length
+
+def Load_Audio(file):
+	"""
+	Decode an audio file (see "Process()" : done while the previous song is processed)
+	"""
+	# TODO : sr = None --> uses the native sampling rate (if 48 Khz or 96 Khz), maybe not good for MDX models ??
+	audio, sample_rate = librosa.load(file, mono=False, sr = 44100)  # Resample to 44.1 Khz
+	
+	# Convert mono to stereo (if needed)
+	if len(audio.shape) == 1:
+		audio = np.stack([audio, audio], axis=0)
+
+	return audio, sample_rate
+
 def Download_Model(model, models_path, CONSOLE = None, PROGRESS = None):
 	
 	name		= model['Name']
@@ -958,17 +1836,32 @@ def Process(options):
 	model = None
 	model = MusicSeparationModel(options)
 
-	# Process each audio file
+	files = []
 	for file in options['input']:
-		
-		if not os.path.isfile(file):
+		if os.path.isfile(file):
+			files.append(file)
+		else:
 			print('Error. No such file : {}. Please check path !'.format(file))
-			continue
+
+	# Process each audio file : the next one is decoded in background (if enabled)
+	try:
+		if options['prefetch'] > 0:
+			# Very long songs are NOT decoded in advance (see "SEPARATE_Stream()")
+			Load = lambda file: None if model.Is_Streamed(file) else Load_Audio(file)
+
+			for file, decoded in App.pipeline.Prefetch(files, Load, options['prefetch']):
+				model.SEPARATE(file, decoded)
+		else:
+			for file in files:
+				model.SEPARATE(file)
+	finally:
+		# Wait for the last files to be written (even if an error occurred)
+		if model.writer is not None:  model.writer.Close()
 		
-		model.SEPARATE(file)
-	
+		if model.scratch is not None:  model.scratch.Close()
+
 	# Free & Release GPU memory
-	if torch.cuda.is_available():
+	if torch is not None and torch.cuda.is_available():
 		torch.cuda.empty_cache()
 		torch.cuda.ipc_collect()
 		
@@ -995,6 +1888,7 @@ if __name__ == '__main__':
 		--output_format MP3
 		--overlap_MDX 0.8
 		--chunk_size 500000
+		--batch_size 4
 		--DEBUG
 	"""
 
@@ -1011,14 +1905,15 @@ if __name__ == '__main__':
 	m.add_argument('--model_instrum', type=str, help='MDX A.I Instrumental model NAME : Replace "spaces" in model\'s name by underscore "_".', default='Instrum HQ 3')
 	m.add_argument('--model_vocals',  type=str, help='MDX A.I Vocals model NAME : Replace "spaces" in model\'s name by underscore "_".', default='Kim Vocal 2')
 	m.add_argument('--bigshifts_MDX', type=int, help='Managing MDX "BigShifts" trick value.', default=12)
-	m.add_argument('--overlap_MDX', type=float, help='Overlap of splited audio for heavy models. Closer to 1.0 - slower.', default=0.8)
+	m.add_argument('--overlap_MDX', type=float, help='Overlap of splited audio chunks, from 0.0 to 0.9 (with crossfade). Closer to 1.0 - slower.', default=0.0)
 #	m.add_argument('--overlap_MDXv3', type=int, help='MDXv3 overlap', default=8)
 	m.add_argument('--chunk_size', type=int, help='Chunk size for ONNX models. Set lower to reduce GPU memory consumption OR if you have GPU memory errors !. Default: 500000', default=500000)
+	m.add_argument('--batch_size', type=int, help='Number of frames sent at once to ONNX models. Set lower to reduce memory consumption. Default: 0 (Auto)', default=0)
 	m.add_argument('--use_SRS', action='store_true', help='Use "SRS" vocal 2nd pass : can be useful for high vocals (Soprano by e.g)', default=False)
-	m.add_argument('--large_gpu', action='store_true', help='It will store all models on GPU for faster processing of multiple audio files. Requires more GB of free GPU memory.', default=False)
+	m.add_argument('--models_RAM_MB', type=int, help='Memory budget for loaded models (RAM, and VRAM on GPU : at least 1024 MB by model) : the least recently used are unloaded when a new one needs the room. Default: 4096 (0 = only one at a time)', default=4096)
 	m.add_argument('--TEST_MODE', action='store_true', help='For testing only : Extract with A.I models with 1 pass instead of 2 passes.\nThe quality will be badder (due to low noise added by MDX models) !', default=False)
 	m.add_argument('--DEBUG', action='store_true', help='This option will save all intermediate audio files to compare with the final result.', default=False)
-	m.add_argument('--GOD_MODE', action='store_true', help='Give you the GOD\'s POWER : each audio file is reloaded IF it was created before,\nNO NEED to process it again and again !!\nYou\'ll be warned : You have to delete each file that you want to re-process MANUALLY !', default=False)
+	m.add_argument('--GOD_MODE', action='store_true', help='Give you the GOD\'s POWER : the RE-Process buttons of the GUI.\n(Reloading the stages processed before with the SAME audio & options is done by the stage cache : see "stage_cache_MB")', default=False)
 	
 	options = m.parse_args().__dict__
 
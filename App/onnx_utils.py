@@ -0,0 +1,317 @@
+#!python3.10
+
+#   MIT License - Copyright (c) 2023 Captain FLAM
+#
+#   https://github.com/Captain-FLAM/KaraFan
+
+import os, numpy as np
+import onnxruntime as ort
+
+# Needs the "onnx" package : only used to build the models with STFT included
+#
+# pip install onnx
+
+STFT_OPSET = 18  # DFT : opset 17, Col2Im : opset 18
+
+GRAPH_LEVELS = {
+	'disabled':	ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+	'basic':	ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+	'extended':	ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+	'all':		ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+def Create_Session(path, providers, options):
+	"""
+	ONNX Runtime session, tuned with the [ONNX] section of "Config_PC.ini".
+
+	The optimized graph is saved next to the model (one file for each provider & level),
+	and it's loaded directly on next runs : no more graph optimization at each load.
+
+	Level "all" includes layout transforms for THIS CPU (e.g. AVX2 vs AVX-512 blocks) :
+	such a graph must not be used on another machine (e.g. another Colab VM, with the same Google Drive).
+	So the graph is saved at level "extended" at most, and "all" is applied again when it's loaded.
+	"""
+	level = options['graph_optimization'].lower()
+	if level not in GRAPH_LEVELS:  level = 'all'
+
+	if options['save_optimized'] and level != 'disabled':
+		
+		saved_level = 'extended' if level == 'all' else level
+
+		provider = providers[0].replace("ExecutionProvider", "")
+		optimized_path = os.path.splitext(path)[0] + f"_{provider}_{saved_level}.optimized.onnx"
+
+		# Re-optimize only if the original model is newer
+		if not os.path.isfile(optimized_path) or os.path.getmtime(optimized_path) < os.path.getmtime(path):
+			
+			session_options = Session_Options(options, saved_level)
+			session_options.optimized_model_filepath = optimized_path
+
+			# Only to save the graph
+			ort.InferenceSession(path, sess_options = session_options, providers = providers, provider_options = [{"device_id": 0}])
+
+			# Old versions : graph saved at level "all"
+			try:
+				os.remove(os.path.splitext(path)[0] + f"_{provider}_all.optimized.onnx")
+			except OSError:
+				pass
+		
+		path = optimized_path
+		if level == saved_level:  level = 'disabled'  # Already done !
+
+	return ort.InferenceSession(
+		path,
+		sess_options = Session_Options(options, level),
+		providers = providers,
+		provider_options = [{"device_id": 0}]
+	)
+
+def Session_Options(options, level):
+
+	session_options = ort.SessionOptions()
+
+	# 0 = Auto (ONNX Runtime default)
+	if options['intra_op_threads'] > 0:  session_options.intra_op_num_threads = options['intra_op_threads']
+	if options['inter_op_threads'] > 0:  session_options.inter_op_num_threads = options['inter_op_threads']
+
+	if options['execution_mode'].lower() == "parallel":
+		session_options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+	else:
+		session_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+
+	session_options.enable_mem_pattern	 = options['mem_pattern']
+	session_options.enable_cpu_mem_arena = options['cpu_mem_arena']
+
+	session_options.graph_optimization_level = GRAPH_LEVELS[level]
+
+	return session_options
+
+def Wrap_STFT_Model(model, hop=1024):
+	"""
+	Build (once) a composite ONNX model that includes :
+	- the STFT pre-processing (same as "Conv_TDF_net_trim_model.stft()")
+	- the original MDX model
+	- the iSTFT post-processing (same as "Conv_TDF_net_trim_model.istft()")
+
+	Inference is then : session.run(waveform) -> waveform , without any framework switch per chunk.
+	Input & Output : "waveform" & "waveform_out" (batch, 2, chunk_size)
+
+	The composite model is cached next to the original one : "<name>_STFT.onnx"
+	Returns : the path of the composite model, or None if it can't be built.
+	"""
+	path = model['PATH']
+	stft_path = os.path.splitext(path)[0] + "_STFT.onnx"
+
+	# Rebuild it only if the original model is newer
+	if os.path.isfile(stft_path) and os.path.getmtime(stft_path) >= os.path.getmtime(path):
+		return stft_path
+
+	try:
+		import onnx
+		from onnx import helper, numpy_helper, version_converter, TensorProto
+	except ImportError:
+		print('The "onnx" package is needed to include STFT in models : "pip install onnx"')
+		return None
+
+	print(f'Include STFT in model "{model["Name"]}" ...')
+
+	n_fft	= model['N_FFT_scale']
+	dim_f	= model['dim_F_set']
+	dim_t	= 2 ** model['dim_T_set']
+	n_bins	= n_fft // 2 + 1
+	chunk_size	= hop * (dim_t - 1)
+	full_size	= hop * (dim_t - 1) + n_fft  # Length of audio before trimming the center padding
+
+	try:
+		mdx = onnx.load(path)
+
+		opset = max([op.version for op in mdx.opset_import if op.domain in ("", "ai.onnx")])
+		if opset < STFT_OPSET:
+			mdx = version_converter.convert_version(mdx, STFT_OPSET)
+
+		graph = mdx.graph
+		spec_in  = graph.input[0].name
+		spec_out = graph.output[0].name
+
+		# Same as torch.hann_window(periodic=True)
+		window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(n_fft) / n_fft)).astype(np.float32)
+
+		# iSTFT normalization by the sum of squared windows (as torch.istft)
+		envelope = np.zeros(full_size, dtype=np.float32)
+		for t in range(dim_t):
+			envelope[t * hop : t * hop + n_fft] += window ** 2
+		envelope = np.where(envelope > 1e-11, 1.0 / np.maximum(envelope, 1e-11), 0.0).astype(np.float32)
+
+		# Framing : the padded audio is cut in blocks of "gcd(n_fft, hop)" samples,
+		# then each frame gathers "n_fft / block" consecutive blocks
+		block = np.gcd(n_fft, hop)
+		frame_blocks = np.arange(dim_t)[:, None] * (hop // block) + np.arange(n_fft // block)[None, :]
+
+		# Mixed-radix DFT (ORT is only fast with sizes that are powers of 2) :
+		# N = P * Q , Q = largest power of 2 that divides N
+		# - DFT of size P : MatMul with the DFT matrix (P is small : 1, 3, 5, 15 ...)
+		# - Twiddle factors
+		# - DFT of size Q : ORT DFT
+		Q = n_fft & -n_fft
+		P = n_fft // Q
+		
+		initializers = []
+		def const(name, value, dtype=np.int64):
+			initializers.append(numpy_helper.from_array(np.array(value, dtype=dtype), "KF_" + name))
+
+		const("window", window, np.float32)
+		const("envelope", envelope, np.float32)
+		const("conj", [1.0, -1.0], np.float32)
+		const("frame_blocks", frame_blocks)
+		const("shape_blocks", [-1, full_size // block, block])
+		const("shape_frames", [-1, dim_t, n_fft])
+		const("shape_PQ", [-1, dim_t, P, Q])
+		const("shape_QP", [-1, dim_t, Q, P, 2])
+		const("shape_N", [-1, dim_t, n_fft])
+		const("shape_N2", [-1, dim_t, n_fft, 2])
+		const("shape_wave", [-1, chunk_size])
+		const("shape_spec", [-1, 4, n_bins, dim_t])
+		const("shape_cplx", [-1, 2, n_bins, dim_t])
+		const("shape_out", [-1, 2, chunk_size])
+		const("pad_center", [0, n_fft // 2, 0, n_fft // 2])
+		const("pad_freq", [0, 0, 0, 0, 0, 0, n_bins - dim_f, 0])
+		const("image_shape", [1, full_size])
+		const("block_shape", [1, n_fft])
+		const("axis_last", [-1])
+		const("axis_freq", [2])
+		const("zero", [0])
+		const("one", [1])
+		const("two", [2])
+		const("dim_f", [dim_f])
+		const("n_bins", [n_bins])
+		const("mirror_start", [n_bins - 2])
+		const("mirror_end", [0])
+		const("minus_one", [-1])
+		const("center_start", [n_fft // 2])
+		const("center_end", [n_fft // 2 + chunk_size])
+
+		# DFT matrices of size P : forward , and inverse (with its 1/P normalization)
+		angle = 2 * np.pi * np.arange(P)[:, None] * np.arange(P)[None, :] / P
+		const("P_cos", np.cos(angle), np.float32)
+		const("P_sin", -np.sin(angle), np.float32)
+		const("P_cos_inv", np.cos(angle) / P, np.float32)
+		const("P_sin_inv", np.sin(angle) / P, np.float32)
+
+		# Twiddle factors : exp(-2i.pi * q * p / N) , shape (Q, P)
+		angle = 2 * np.pi * np.arange(Q)[:, None] * np.arange(P)[None, :] / n_fft
+		const("tw_cos", np.cos(angle), np.float32)
+		const("tw_sin", -np.sin(angle), np.float32)
+		const("tw_sin_inv", np.sin(angle), np.float32)
+
+		# Names starting with "@" are NOT prefixed (= tensors of the MDX model)
+		def N(op, inputs, output, **attrs):
+			inputs  = [i[1:] if i.startswith("@") else "KF_" + i for i in inputs]
+			output  = output[1:] if output.startswith("@") else "KF_" + output
+			return helper.make_node(op, inputs, [output], name=output + "_" + op, **attrs)
+
+		def Complex_Mul(a, b, c, d, out):
+			"""
+			(a + ib) * (c + id) -> out_re , out_im
+			"""
+			return [
+				N("Mul",		[a, c], out + "_ac"),
+				N("Mul",		[b, d], out + "_bd"),
+				N("Mul",		[a, d], out + "_ad"),
+				N("Mul",		[b, c], out + "_bc"),
+				N("Sub",		[out + "_ac", out + "_bd"], out + "_re"),
+				N("Add",		[out + "_ad", out + "_bc"], out + "_im"),
+			]
+
+		# Forward (real input) : n = Q * n1 + n2  ->  k = k1 + P * k2
+		def Forward_DFT(x, out):
+			"""
+			(B*2, T, n_fft) real -> (B*2, T, n_fft, 2)
+			"""
+			return [
+				N("Reshape",	[x, "shape_PQ"], out + "_PQ"),
+				N("Transpose",	[out + "_PQ"], out + "_QP", perm=[0, 1, 3, 2]),					# (B*2, T, Q[n2], P[n1])
+				N("MatMul",		[out + "_QP", "P_cos"], out + "_a"),								# (B*2, T, Q[n2], P[k1])
+				N("MatMul",		[out + "_QP", "P_sin"], out + "_b"),
+			] + Complex_Mul(out + "_a", out + "_b", "tw_cos", "tw_sin", out + "_tw") + [
+				N("Unsqueeze",	[out + "_tw_re", "axis_last"], out + "_c"),
+				N("Unsqueeze",	[out + "_tw_im", "axis_last"], out + "_d"),
+				N("Concat",		[out + "_c", out + "_d"], out + "_tw", axis=-1),
+				N("DFT",		[out + "_tw"], out + "_Q", axis=2),								# (B*2, T, Q[k2], P[k1], 2)
+				N("Reshape",	[out + "_Q", "shape_N2"], out),
+			]
+
+		# Inverse (real output) : k = k1 + P * k2  ->  n = Q * n1 + n2
+		def Inverse_DFT(x, out):
+			"""
+			(B*2, T, n_fft, 2) -> (B*2, T, n_fft) real part
+			"""
+			return [
+				N("Reshape",	[x, "shape_QP"], out + "_QP"),										# (B*2, T, Q[k2], P[k1], 2)
+				N("DFT",		[out + "_QP"], out + "_Q", axis=2, inverse=1),						# (B*2, T, Q[n2], P[k1], 2)
+				N("Slice",		[out + "_Q", "zero", "one", "axis_last"], out + "_re"),
+				N("Slice",		[out + "_Q", "one", "two", "axis_last"], out + "_im"),
+				N("Squeeze",	[out + "_re", "axis_last"], out + "_a"),
+				N("Squeeze",	[out + "_im", "axis_last"], out + "_b"),
+			] + Complex_Mul(out + "_a", out + "_b", "tw_cos", "tw_sin_inv", out + "_tw") + [
+				# Real part only
+				N("MatMul",		[out + "_tw_re", "P_cos_inv"], out + "_cc"),						# (B*2, T, Q[n2], P[n1])
+				N("MatMul",		[out + "_tw_im", "P_sin_inv"], out + "_ds"),
+				N("Sub",		[out + "_cc", out + "_ds"], out + "_P"),
+				N("Transpose",	[out + "_P"], out + "_PQ", perm=[0, 1, 3, 2]),					# (B*2, T, P[n1], Q[n2])
+				N("Reshape",	[out + "_PQ", "shape_N"], out),
+			]
+
+		pre = [
+			N("Reshape",	["@waveform", "shape_wave"], "wave"),								# (B*2, chunk)
+			N("Pad",		["wave", "pad_center"], "wave_pad", mode="reflect"),				# center = True
+			N("Reshape",	["wave_pad", "shape_blocks"], "blocks"),
+			N("Gather",		["blocks", "frame_blocks"], "frames_blocks", axis=1),
+			N("Reshape",	["frames_blocks", "shape_frames"], "frames_in"),					# (B*2, T, n_fft)
+			N("Mul",		["frames_in", "window"], "frames_win_in"),
+		] + Forward_DFT("frames_win_in", "spectrum") + [
+			N("Slice",		["spectrum", "zero", "n_bins", "axis_freq"], "stft"),				# (B*2, T, n_bins, 2)
+			N("Transpose",	["stft"], "stft_T", perm=[0, 3, 2, 1]),							# (B*2, 2, n_bins, T)
+			N("Reshape",	["stft_T", "shape_spec"], "spec"),									# (B, 4, n_bins, T)
+			N("Slice",		["spec", "zero", "dim_f", "axis_freq"], "@" + spec_in),			# (B, 4, dim_f, T)
+		]
+
+		post = [
+			N("Pad",		["@" + spec_out, "pad_freq"], "out_pad"),							# (B, 4, n_bins, T)
+			N("Reshape",	["out_pad", "shape_cplx"], "out_cplx"),							# (B*2, 2, n_bins, T)
+			N("Transpose",	["out_cplx"], "out_T", perm=[0, 3, 2, 1]),							# (B*2, T, n_bins, 2)
+			# Rebuild the full spectrum (Hermitian symmetry) for the inverse DFT
+			N("Slice",		["out_T", "mirror_start", "mirror_end", "axis_freq", "minus_one"], "mirror"),
+			N("Mul",		["mirror", "conj"], "mirror_conj"),
+			N("Concat",		["out_T", "mirror_conj"], "full", axis=2),							# (B*2, T, n_fft, 2)
+		] + Inverse_DFT("full", "frames") + [
+			N("Mul",		["frames", "window"], "frames_win"),
+			N("Transpose",	["frames_win"], "frames_T", perm=[0, 2, 1]),						# (B*2, n_fft, T)
+			# Overlap-Add
+			N("Col2Im",		["frames_T", "image_shape", "block_shape"], "ola", strides=[1, hop]),	# (B*2, 1, 1, L)
+			N("Mul",		["ola", "envelope"], "ola_norm"),
+			N("Slice",		["ola_norm", "center_start", "center_end", "axis_last"], "wave_out"),
+			N("Reshape",	["wave_out", "shape_out"], "@waveform_out"),						# (B, 2, chunk)
+		]
+
+		# Replace the spectrogram Input/Output of the MDX model by waveforms
+		nodes = pre + list(graph.node) + post
+		del graph.node[:]
+		graph.node.extend(nodes)
+		graph.initializer.extend(initializers)
+
+		del graph.input[:]
+		del graph.output[:]
+		graph.input.append(helper.make_tensor_value_info("waveform", TensorProto.FLOAT, ["batch", 2, chunk_size]))
+		graph.output.append(helper.make_tensor_value_info("waveform_out", TensorProto.FLOAT, ["batch", 2, chunk_size]))
+
+		if mdx.ir_version < 8:  mdx.ir_version = 8
+
+		onnx.checker.check_model(mdx)
+		onnx.save(mdx, stft_path)
+
+	except Exception as e:
+		print(f'Error while including STFT in model "{model["Name"]}" : {e}')
+		if os.path.isfile(stft_path):  os.remove(stft_path)
+		return None
+
+	return stft_path
@@ -0,0 +1,126 @@
+#!python3.10
+
+#   MIT License - Copyright (c) 2023 Captain FLAM
+#
+#   https://github.com/Captain-FLAM/KaraFan
+
+import os, sys, numpy as np
+import multiprocessing as mp
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
+
+# In each worker process
+engine = None
+shared = {}
+
+def Worker_Init(options, threads):
+	"""
+	Headless separation engine : no widgets, and its own part of the CPU cores
+	"""
+	global engine
+	import App.inference, App.progress
+
+	sys.stdout = open(os.devnull, 'w')  # Messages are printed by the main process
+
+	App.inference.FFT_THREADS = threads
+	if App.inference.torch is not None:  App.inference.torch.set_num_threads(threads)
+
+	options = dict(options)
+	options['CONSOLE']	= None
+	options['Status']	= App.progress.Headless()
+	options['Progress']	= App.progress.Headless()
+	options['intra_op_threads'] = threads
+	options['inter_op_threads'] = 1
+
+	engine = App.inference.MusicSeparationModel(options)
+
+	# Delete the scratch folder of this worker when it exits
+	if engine.scratch is not None:
+		mp.util.Finalize(engine.scratch, engine.scratch.Close, exitpriority = 10)
+
+def Worker_Extract(type, model_name, audio_info, sample_rate):
+
+	name, shape, dtype = audio_info
+
+	if name not in shared:
+		shared[name] = shared_memory.SharedMemory(name=name)
+
+	audio = np.ndarray(shape, dtype=dtype, buffer=shared[name].buf)
+	audio.flags.writeable = False
+
+	for stem in engine.models:
+		for model in engine.models[stem]:
+			if model['Name'] == model_name:
+				engine.sample_rate = sample_rate
+				result = engine.Extract_with_Model(type, audio, model)
+
+				if engine.scratch is not None:
+					result = np.array(result)  # Sent back to the main process : NOT a memory-mapped file !
+					engine.scratch.Clear()
+
+				return result
+	
+	raise ValueError(f'Model "{model_name}" not found in worker !')
+
+class Extract_Pool:
+	"""
+	Independent extractions run in worker processes (for CPU only) :
+	- the input audio is shared through shared memory, NOT pickled
+	- the CPU cores are split between workers
+	Workers live only for one batch of extractions :
+	their memory (models, buffers & caches) is released before the rest of the process.
+	"""
+	def __init__(self, options, workers):
+
+		threads = max(1, (os.cpu_count() or 1) // workers)
+
+		# Widgets can't be sent to other processes
+		options = {key: value for key, value in options.items() if key not in ['CONSOLE', 'Status', 'Progress']}
+
+		# Memory budgets are shared between workers
+		options['spec_cache_MB'] = options['spec_cache_MB'] // workers
+		options['models_RAM_MB'] = options['models_RAM_MB'] // workers
+
+		# Results are saved in the stage cache (and files are read & written) by the main process
+		options['stage_cache_MB'] = 0
+		options['audio_writers']  = 0
+		options['prefetch']       = 0
+
+		self.executor = ProcessPoolExecutor(
+			max_workers = workers,
+			mp_context = mp.get_context('spawn'),
+			initializer = Worker_Init,
+			initargs = (options, threads)
+		)
+
+	def Extract(self, tasks, audio, sample_rate, Progress = None):
+		"""
+		tasks : list of (type, model)
+		Returns : the extracted audio of each task, in the SAME order
+		"""
+		shm = shared_memory.SharedMemory(create=True, size=audio.nbytes)
+		
+		shared_audio = np.ndarray(audio.shape, dtype=audio.dtype, buffer=shm.buf)
+		shared_audio[:] = audio
+		del shared_audio  # Needed to close the shared memory
+		
+		try:
+			audio_info = (shm.name, audio.shape, audio.dtype.str)
+
+			futures = [self.executor.submit(Worker_Extract, type, model['Name'], audio_info, sample_rate) for type, model in tasks]
+
+			if Progress is not None:
+				Progress.reset(len(futures), unit="Model")
+				for _ in as_completed(futures):  Progress.update()
+
+			return [future.result() for future in futures]
+		finally:
+			shm.close()
+			shm.unlink()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.executor.shutdown()
@@ -0,0 +1,120 @@
+#!python3.10
+
+#   MIT License - Copyright (c) 2023 Captain FLAM
+#
+#   https://github.com/Captain-FLAM/KaraFan
+
+import queue, threading, numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Multi-files processing in 3 stages, working at the same time :
+#
+#   Prefetch : decode song N+1  -->  SEPARATE : song N  -->  Writer : encode stems of song N-1
+#
+# Each stage has a bounded queue, so memory stays capped.
+
+class Prefetch:
+	"""
+	Decode the next songs in a background thread, while the current one is processed.
+	"depth" : max number of decoded songs waiting in the queue (or being decoded)
+	"""
+	def __init__(self, files, Load, depth = 1):
+		self.queue = queue.Queue()
+		self.slots = threading.Semaphore(max(1, depth))  # Taken BEFORE decoding : no extra song waiting for its place
+		self.thread = threading.Thread(target = self.Run, args = (files, Load), daemon = True)
+		self.thread.start()
+
+	def Run(self, files, Load):
+		for file in files:
+			self.slots.acquire()
+			try:
+				self.queue.put((file, Load(file), None))
+			except Exception as e:
+				self.queue.put((file, None, e))
+
+		self.queue.put(None)  # The End
+
+	def __iter__(self):
+		"""
+		Returns : (file, decoded audio) in the SAME order as "files"
+		"""
+		while True:
+			item = self.queue.get()
+			if item is None:  return
+
+			self.slots.release()  # The next song can be decoded
+
+			file, audio, error = item
+			if error is not None:  raise error
+
+			yield file, audio
+
+class Writer:
+	"""
+	Encode & write audio files in background threads, while the separation goes on.
+	"max_pending" : max number of files waiting to be written (their audio is kept in memory)
+	"""
+	def __init__(self, workers = 2, max_pending = 8):
+		self.executor = ThreadPoolExecutor(max_workers = workers)
+		self.slots = threading.Semaphore(max_pending)
+		self.futures = []
+
+	def Submit(self, name, function, *args):
+		"""
+		"name" : shown in the error message if this job fails
+		The arrays given in "args" are copied : the caller can still modify its own arrays.
+		"""
+		self.Check()  # Stop as soon as possible if a previous file has failed
+
+		args = [Own(arg) if isinstance(arg, np.ndarray) else arg for arg in args]
+
+		self.slots.acquire()  # Wait if too many files are pending
+
+		future = self.executor.submit(function, *args)
+		future.name = name
+		future.add_done_callback(lambda _: self.slots.release())
+		self.futures.append(future)
+
+	def Check(self):
+		"""
+		Raise the error of the first failed job (if any), and forget the finished ones
+		"""
+		pending = []
+		for future in self.futures:
+			if future.done():
+				Result(future)
+			else:
+				pending.append(future)
+		
+		self.futures = pending
+
+	def Flush(self):
+		"""
+		Wait until ALL files are written (and raise the first error, if any)
+		"""
+		futures, self.futures = self.futures, []
+		for future in futures:  Result(future)
+
+	def Close(self):
+		try:
+			self.Flush()
+		finally:
+			self.executor.shutdown()
+
+def Own(array):
+	"""
+	Private copy of an array given to a background job : a later "in-place" change of the caller
+	can't corrupt the file being written, and the caller's array stays writeable.
+	"""
+	array = array.copy()
+	
+	array.flags.writeable = False
+	return array
+
+def Result(future):
+
+	try:
+		return future.result()
+	except Exception as e:
+		raise RuntimeError(f'Error while writing "{future.name}" !!\n\n{e}') from e
@@ -50,3 +50,16 @@ class Bar:
 	def close(self):
 		# Fermez le layout
 		self.layout.close()
+
+class Headless:
+	"""
+	Same interface as "Bar" (and Status Led), but shows nothing : for worker processes
+	"""
+	def __init__(self):
+		self.value = None
+
+	def reset(self, total, unit=''):
+		pass
+
+	def update(self, increment=1):
+		pass
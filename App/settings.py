@@ -25,17 +25,44 @@ defaults = {
 	},
 	'OPTIONS': {
 		'normalize': False,
-		'large_gpu': True,
+		'models_RAM_MB': 4096,  # RAM (and VRAM on GPU) of the loaded models
 		'shifts_vocals': 12,
 		'shifts_instru': 12,
 		'shifts_filter': 3,
 #		'overlap_MDXv3': 8,
+		'overlap_MDX': 0.0,
 		'chunk_size': 500000,
+		'batch_size': "Auto",
+	},
+	'PERFORMANCE': {
+		'batch_shifts': True,
+		'paired_polarity': True,
+		'stft_backend': "Auto",  # Auto, Torch, NumPy (Auto = Torch if installed)
+		'onnx_stft': False,  # Experimental : STFT & iSTFT inside the ONNX graph (needs "onnx" package)
+		'srs_spectral': False,  # Experimental : SRS by stretching the spectrograms, without resampling the audio
+		'spec_cache_MB': 2048,  # Spectrograms of the input shared between models (0 = disabled)
+		'parallel_workers': 0,  # Independent extractions in worker processes, for CPU only (0 = disabled)
+		'prefetch': 1,  # Songs decoded in background, while the current one is processed (0 = disabled)
+		'audio_writers': 2,  # Audio files written in background (0 = disabled)
+		'stream_minutes': 30,  # Longer songs are processed block by block, with constant memory (0 = disabled)
+		'stream_block': 180,  # Seconds of audio in each block
+		'scratch_folder': "",  # Big intermediate arrays in memory-mapped files in this folder (empty = in RAM)
+		'stage_cache_MB': 4096,  # Results of each stage kept on disk, for the next runs with the same input & options (0 = disabled)
+		'stage_folder': "",  # Folder of the stage cache (empty = on the local disk, NOT in Google Drive)
+	},
+	'ONNX': {
+		'intra_op_threads': 0,  # 0 = Auto
+		'inter_op_threads': 0,  # 0 = Auto
+		'execution_mode': "Sequential",  # Sequential, Parallel
+		'graph_optimization': "All",  # Disabled, Basic, Extended, All
+		'mem_pattern': True,
+		'cpu_mem_arena': True,
+		'save_optimized': True,  # Save the optimized models for faster loading
 	},
 	'BONUS': {
 		'TEST_MODE': False,
 		'DEBUG': False,
-		'GOD_MODE': False,
+		'GOD_MODE': False,  # Only shows the RE-Process buttons of the GUI (reloading the stages is done by "stage_cache_MB")
 		'PREVIEWS': False,
 	},
 }
@@ -55,12 +82,35 @@ def Convert_to_Options(config):
 	options['filter_3']			= config['PROCESS']['filter_3']
 	options['filter_4']			= config['PROCESS']['filter_4']
 	options['normalize']		= (config['OPTIONS']['normalize'].lower() == "true")
-	options['large_gpu']		= (config['OPTIONS']['large_gpu'].lower() == "true")
+	options['models_RAM_MB']	= int(config['OPTIONS']['models_RAM_MB'])
 	options['shifts_vocals']	= int(config['OPTIONS']['shifts_vocals'])
 	options['shifts_instru']	= int(config['OPTIONS']['shifts_instru'])
 	options['shifts_filter']	= int(config['OPTIONS']['shifts_filter'])
 #	options['overlap_MDXv3']	= int(config['OPTIONS']['overlap_MDXv3'])
+	options['overlap_MDX']		= float(config['OPTIONS']['overlap_MDX'])
 	options['chunk_size']		= int(config['OPTIONS']['chunk_size'])
+	options['batch_size']		= 0 if config['OPTIONS']['batch_size'].lower() == "auto" else int(config['OPTIONS']['batch_size'])
+	options['batch_shifts']		= (config['PERFORMANCE']['batch_shifts'].lower() == "true")
+	options['paired_polarity']	= (config['PERFORMANCE']['paired_polarity'].lower() == "true")
+	options['stft_backend']		= config['PERFORMANCE']['stft_backend']
+	options['onnx_stft']		= (config['PERFORMANCE']['onnx_stft'].lower() == "true")
+	options['srs_spectral']		= (config['PERFORMANCE']['srs_spectral'].lower() == "true")
+	options['spec_cache_MB']	= int(config['PERFORMANCE']['spec_cache_MB'])
+	options['parallel_workers']	= int(config['PERFORMANCE']['parallel_workers'])
+	options['prefetch']			= int(config['PERFORMANCE']['prefetch'])
+	options['audio_writers']	= int(config['PERFORMANCE']['audio_writers'])
+	options['stream_minutes']	= int(config['PERFORMANCE']['stream_minutes'])
+	options['stream_block']		= int(config['PERFORMANCE']['stream_block'])
+	options['scratch_folder']	= config['PERFORMANCE']['scratch_folder']
+	options['stage_cache_MB']	= int(config['PERFORMANCE']['stage_cache_MB'])
+	options['stage_folder']		= config['PERFORMANCE']['stage_folder']
+	options['intra_op_threads']	= int(config['ONNX']['intra_op_threads'])
+	options['inter_op_threads']	= int(config['ONNX']['inter_op_threads'])
+	options['execution_mode']	= config['ONNX']['execution_mode']
+	options['graph_optimization']	= config['ONNX']['graph_optimization']
+	options['mem_pattern']		= (config['ONNX']['mem_pattern'].lower() == "true")
+	options['cpu_mem_arena']	= (config['ONNX']['cpu_mem_arena'].lower() == "true")
+	options['save_optimized']	= (config['ONNX']['save_optimized'].lower() == "true")
 	options['TEST_MODE']		= (config['BONUS']['TEST_MODE'].lower() == "true")
 	options['DEBUG']			= (config['BONUS']['DEBUG'].lower() == "true")
 	options['GOD_MODE']			= (config['BONUS']['GOD_MODE'].lower() == "true")
@@ -79,6 +129,14 @@ def Load(Gdrive, isColab):
 	if os.path.isfile(file):
 		config.read(file, encoding='utf-8')
 		
+		# Old versions : "large_gpu" is replaced by a memory budget for models
+		if 'OPTIONS' in config and 'large_gpu' in config['OPTIONS']:
+			if 'models_RAM_MB' not in config['OPTIONS']:
+				large_gpu = (config['OPTIONS']['large_gpu'].lower() == "true")
+				config['OPTIONS']['models_RAM_MB'] = str(defaults['OPTIONS']['models_RAM_MB'] if large_gpu else 0)
+			
+			del config['OPTIONS']['large_gpu']
+
 		# Load default values if not present
 		for section in defaults:
 			if section not in config: